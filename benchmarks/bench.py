@@ -0,0 +1,277 @@
+# Benchmark suite of the simulation engines, of the statistics kernels and of the plotting phase
+# Usage: python benchmarks/bench.py [--quick] [--filter REGEX] [--baseline FILE] [--save] [--threshold RATIO] [--check]
+#
+# Every case is timed on fixed seeds, best of --repeat executions after a warm-up one, and its peak memory is measured by tracemalloc in
+# a further execution. Results are compared against the JSON baseline, if any: the suite fails when a case is slower
+# than the baseline by more than the threshold ratio. --save overwrites the baseline with the current results.
+# --check runs the equivalence check of the engines against the fixed-increment loop instead of the benchmarks.
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The simulator modules import each other as top level scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'simulator'))
+
+import numpy as np
+
+import aloha
+import csma
+import config
+import plotting
+import rng
+import stats
+import utils
+
+SEED = 42
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Simulation cases: engines x protocols x number of stations x number of epochs x number of runs
+MATRIX = {
+    'full': {
+        'engines': ['object', 'event', 'vectorized']
+        , 'num_stations': [4, 16, 64, 256, 1024]
+        , 'num_epochs': [1000, 10000]
+        , 'num_runs': [4, 32]
+        , 'sample_sizes': [1000, 100000]
+    },
+    # Subset of the full matrix, so that its cases are compared against the same baseline
+    'quick': {
+        'engines': ['object', 'event', 'vectorized']
+        , 'num_stations': [4, 64]
+        , 'num_epochs': [1000]
+        , 'num_runs': [4]
+        , 'sample_sizes': [1000]
+    }
+}
+
+PROTOCOLS = {'aloha': aloha, 'csma': csma}
+
+# Equivalence check: engines compared with the fixed-increment loop of the object engine, on the same seeds
+CHECK = {
+    'engines': ['event', 'vectorized']
+    , 'num_stations': [4, 16]
+    , 'num_epochs': 500
+    , 'num_runs': 2000
+    # Largest difference of the means allowed, in standard errors of the difference
+    , 'max_z': 4.0
+}
+
+
+def bench_config(engine, num_epochs):
+    """Simulation config of the benchmarks, independent of the settings of config.ini but for the mandatory ones"""
+    cfg = config.Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config.ini'))
+    cfg.engine = engine
+    cfg.rng_backend = 'python'
+    cfg.variance_reduction = 'none'
+    cfg.num_epochs = num_epochs
+    cfg.max_backoff_time = 32
+    cfg.packet_prob_ranges = {'aloha': (0.05, 0.2), 'csma': (0.05, 0.4)}
+    cfg.packet_size_range = (1, 3)
+    return cfg
+
+
+def measure(func, repeat):
+    """Best wall time of func over the given number of executions, and its peak traced memory in bytes"""
+    # Warm-up execution, untimed: the first call pays for the lazy imports, e.g. of SciPy and matplotlib
+    func()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    # Tracing memory slows down the execution, the peak is measured apart
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(times), peak
+
+
+def simulation_cases(matrix, logger):
+    """(name, function, work) of each simulation case, work being its number of epochs times stations"""
+    for engine in matrix['engines']:
+        for protocol, module in PROTOCOLS.items():
+            for ns in matrix['num_stations']:
+                for ne in matrix['num_epochs']:
+                    for nr in matrix['num_runs']:
+                        cfg = bench_config(engine, ne)
+                        cfg.chunk_size = nr
+                        seeds = rng.replication_seeds(SEED, nr)
+                        yield ('sim/%s/%s/stations=%d/epochs=%d/runs=%d' % (engine, protocol, ns, ne, nr),
+                               lambda m=module, n=ns, c=cfg, s=seeds: m.run_replications(n, c, s, logger),
+                               ns * ne * nr, 'epochs*stations')
+
+
+def sample(size):
+    """Skewed, non-negative, sample, alike the simulations' delays"""
+    return np.random.default_rng(SEED).lognormal(3, 1, size)
+
+
+def stats_cases(matrix):
+    for size in matrix['sample_sizes']:
+        data = sample(size)
+        yield ('stats/compute_stats_batch/n=%d' % size,
+               lambda d=data: stats.compute_stats_batch([d]), size, 'samples')
+        yield ('stats/bootstrap_ci/n=%d' % size,
+               lambda d=np.sort(data): stats.bootstrap_ci(d, 2000, rng_=np.random.default_rng(SEED)), size, 'samples')
+        yield ('stats/streaming_summary/n=%d' % size,
+               lambda d=data: stats.StreamingSummary(seed=SEED).update_many(d), size, 'samples')
+        yield ('stats/rescale_data/n=%d' % size,
+               lambda d=data: stats.rescale_data(d), size, 'samples')
+
+
+def plot_cases(matrix):
+    for size in matrix['sample_sizes']:
+        data = sample(size)
+        args = {
+            'plot_histogram': ({'delay': data}, 'delay', 'bench', size, round(np.sqrt(size)), True),
+            'plot_ecdf': ({'delay': data}, 'delay', 'bench', './plots/bench_ecdf.png', True, 0.001),
+            'plot_lorenz_curve': (data, 'bench', './plots/bench_lorenz.png', True, 0.001),
+            'plot_qqplot': (data, 'bench', './plots/bench_qqplot.png', True),
+        }
+        for func_name, a in args.items():
+            yield ('plot/%s/n=%d' % (func_name, size),
+                   lambda f=func_name, a=a: plotting.render(f, a, {}), size, 'samples')
+
+
+def check_engines(logger, check=CHECK):
+    """
+    Seeded equivalence check of the engines with the object engine, for each protocol, number of stations and metric:
+    the means of both engines must differ by less than max_z standard errors of their difference, and their 95%
+    confidence intervals must overlap. Engines draw their random numbers in a different order, so their samples only
+    agree statistically. Returns the names of the cases failing the check.
+    """
+    failures = []
+    seeds = rng.replication_seeds(SEED, check['num_runs'])
+    for protocol, module in PROTOCOLS.items():
+        for ns in check['num_stations']:
+            cfg = bench_config('object', check['num_epochs'])
+            reference = module.run_replications(ns, cfg, seeds, logger)
+
+            for engine in check['engines']:
+                cfg = bench_config(engine, check['num_epochs'])
+                res = module.run_replications(ns, cfg, seeds, logger)
+
+                for metric, values in reference.items():
+                    a, b = np.asarray(values, dtype=float), np.asarray(res[metric], dtype=float)
+                    se = np.sqrt(np.var(a, ddof=1) / len(a) + np.var(b, ddof=1) / len(b))
+                    diff = stats.compute_mean(b) - stats.compute_mean(a)
+                    z = abs(diff) / se if se else (0.0 if not diff else np.inf)
+                    ci_a, ci_b = stats.compute_confidence_interval(a), stats.compute_confidence_interval(b)
+                    # Intervals of constant samples are NaN, their means are compared through z only
+                    overlap = not (ci_a[1] < ci_b[0] or ci_b[1] < ci_a[0])
+
+                    name = 'check/%s/%s/stations=%d/%s' % (engine, protocol, ns, metric)
+                    ok = z <= check['max_z'] and overlap
+                    if not ok:
+                        failures.append(name)
+                    print("%-50s object %12.4f [%.4f, %.4f] %-10s %12.4f [%.4f, %.4f] %6.2f se %s" %
+                          (name, stats.compute_mean(a), *ci_a, engine, stats.compute_mean(b), *ci_b, z,
+                           'OK' if ok else 'FAIL'), flush=True)
+
+    return failures
+
+
+def run(cases, repeat, pattern):
+    results = {}
+    for name, func, work, unit in cases:
+        if pattern and not re.search(pattern, name):
+            continue
+        seconds, peak = measure(func, repeat)
+        results[name] = {'seconds': seconds, 'rate': work / seconds, 'unit': unit + '/s', 'peak_bytes': peak}
+        print("%-60s %10.4f s %14.0f %-18s %10.0f KB" % (name, seconds, work / seconds, unit + '/s', peak / 2 ** 10),
+              flush=True)
+    return results
+
+
+def machine():
+    """Description of the current machine, saved along with the baseline"""
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor()}
+
+
+def compare(results, baseline, threshold):
+    """Names of the cases slower than the baseline by more than the threshold ratio"""
+    regressions = []
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        ratio = res['seconds'] / baseline[name]['seconds']
+        if ratio > threshold:
+            regressions.append(name)
+            print("REGRESSION %-49s %.2fx slower than the baseline (%.4f s)" % (name, ratio, baseline[name]['seconds']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation engines, statistics and plots")
+    parser.add_argument('--quick', action='store_true', help="small matrix, e.g. for a pre-commit check")
+    parser.add_argument('--filter', default=None, help="only run the cases whose name matches the regex")
+    parser.add_argument('--repeat', type=int, default=3, help="executions of each case, the best one is kept")
+    parser.add_argument('--baseline', default=BASELINE, help="JSON baseline file")
+    parser.add_argument('--save', action='store_true', help="save the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=1.25, help="maximum slowdown ratio against the baseline")
+    parser.add_argument('--check', action='store_true',
+                        help="check that the engines agree with the object engine, instead of timing them")
+    args = parser.parse_args()
+
+    if args.check:
+        failures = check_engines(utils.init_logger())
+        if failures:
+            sys.exit("%d cases where the engines disagree with the object engine" % len(failures))
+        return
+
+    matrix = MATRIX['quick' if args.quick else 'full']
+    baseline = os.path.abspath(args.baseline)
+    logger = utils.init_logger()
+    plotting.init_worker()
+
+    # Plots are saved into a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix='bench-'))
+    os.makedirs('plots')
+
+    results = run(simulation_cases(matrix, logger), args.repeat, args.filter)
+    results.update(run(stats_cases(matrix), args.repeat, args.filter))
+    results.update(run(plot_cases(matrix), args.repeat, args.filter))
+
+    regressions = []
+    if os.path.exists(baseline):
+        with open(baseline) as f:
+            saved = json.load(f)
+        # Timings are absolute: against another machine's baseline the threshold is meaningless
+        current = machine()
+        for key in sorted(current):
+            if saved['machine'].get(key) != current[key]:
+                print("WARNING baseline saved on another machine, %s %s here, %s in the baseline: save a baseline of "
+                      "this machine with --save" % (key, current[key], saved['machine'].get(key)))
+        regressions = compare(results, saved['results'], args.threshold)
+    else:
+        print("No baseline %s, nothing to compare against: run with --save to create it" % baseline)
+
+    if args.save:
+        with open(baseline, 'w') as f:
+            json.dump({
+                'created': time.strftime("%Y-%m-%d %H:%M:%S")
+                , 'machine': machine()
+                , 'results': results
+            }, f, indent=1, sort_keys=True)
+        print("Baseline saved to %s" % baseline)
+
+    if regressions:
+        sys.exit("%d cases slower than the baseline by more than %.2fx" % (len(regressions), args.threshold))
+
+
+if __name__ == "__main__":
+    main()
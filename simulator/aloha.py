@@ -1,36 +1,57 @@
+import logging
+
+import numpy as np
+
 from channel import Channel
-from station import AlohaStation
+from station import AlohaStation, Station, StationTable, TimerWheel
 
-import simulations
 import stats
 import rng
+import runner
+import events
+import cache
+import profiling
+import tracing
 
 
-def sim_aloha(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
+def sim_aloha(num_stations, cfg, packet_probs, packet_sizes, rng_, logger, tracer=None):
     total_transmissions = 0
     collisions = 0
 
     # Instance of a new channel
     channel = Channel()
     # Init stations
-    stations = [AlohaStation(i, packet_probs[i], packet_sizes[i], rng_, cfg.max_backoff_time) for i in range(num_stations)]
+    # A single generator shared by all the stations, or one generator per station for common random numbers
+    rngs_ = rng_ if isinstance(rng_, list) else [rng_] * num_stations
+    stations = [AlohaStation(i, packet_probs[i], packet_sizes[i], rngs_[i], cfg.max_backoff_time)
+                for i in range(num_stations)]
+    # Stations waiting for their backoff are held by the wheel, only the other ones are scanned
+    wheel = TimerWheel(stations, cfg.max_backoff_time)
+
+    # Phase timers, None unless profiling is enabled
+    clock = profiling.phase_clock('aloha', ('scan', 'transmit', 'resolve', 'countdown'))
+    # Collisions are only formatted into debug messages if they are going to be logged
+    debug_ = logger.isEnabledFor(logging.DEBUG)
 
     # Time advances with fixed increments
     for epoch in range(cfg.num_epochs):
 
+        if clock:
+            clock.start()
+
         # Only for debug purposes
         if (epoch + 1) % 1000 == 0:
             logger.debug(("Processing %d epoch" % (epoch + 1)))
 
         # List of stations ready to transmit a frame
-        transmitting = [s for s in stations if s.has_frame_to_transmit()]
-
-        # List of nodes waiting for the backoff time to be over
-        waiting = [s for s in stations if s.is_waiting()]
+        transmitting = [s for s in wheel.active if s.has_frame_to_transmit()]
 
         # Keep count of total transmission
         total_transmissions += len(transmitting)
 
+        if clock:
+            clock.lap(0)
+
         # Check if there are nodes ready to transmit
         if not transmitting:
             # No nodes ready to start a transmission
@@ -41,6 +62,11 @@ def sim_aloha(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
             txs.start_tx()
             # Start transmission
             channel.transmit(epoch, txs.packet_size)
+            if tracer:
+                tracer.record(epoch, txs.id, tracing.TX)
+
+        if clock:
+            clock.lap(1)
 
         # Only one node is trying to transmit on the channel
         if len(transmitting) == 1:
@@ -50,11 +76,14 @@ def sim_aloha(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
             s.get_ack()
             # Deliver the package, free the channel
             channel.deliver()
+            if tracer:
+                tracer.record(epoch, s.id, tracing.ACK)
         else:
             # Multiple nodes are trying to send over the channel, this lead to a collision
             # Debug purposes
-            logger.debug("Slot %d : collision detected between %d nodes" % (epoch + 1, len(transmitting)))
-            logger.debug('Colliding nodes: %s' % ', '.join(str(t) for t in transmitting))
+            if debug_:
+                logger.debug("Slot %d : collision detected between %d nodes" % (epoch + 1, len(transmitting)))
+                logger.debug('Colliding nodes: %s' % ', '.join(str(t) for t in transmitting))
 
             # In case of collision sent packets are lost
             for txs in transmitting:
@@ -62,13 +91,29 @@ def sim_aloha(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
                 collisions += len(transmitting)
                 # Sending station has to handle with the collision
                 txs.handle_collision()
+                if txs.state == Station.WAIT:
+                    wheel.schedule(txs)
+                if tracer:
+                    # A station back IDLE has dropped its packet
+                    tracer.record(epoch, txs.id, tracing.DROP if txs.state == Station.IDLE else tracing.COLLISION,
+                                  txs.backoff_time)
 
-        # Decrease waiting time for stations in WAIT state, as a way to
-        # simulate the time clock advancing
-        # Once waiting time is back to 0 the station will be
+        if clock:
+            clock.lap(2)
+
+        # Time advances for stations in WAIT state, the ones which entered it in this epoch excluded
+        # Once waiting time is over the station will be
         # ready to retransmit the package
-        for w in waiting:
-            w.decrease_waiting_time()
+        expired = wheel.advance()
+        if tracer:
+            for w in sorted(expired, key=lambda s: s.id):
+                tracer.record(epoch, w.id, tracing.RESUME)
+
+        if clock:
+            clock.lap(3)
+
+    if clock:
+        clock.stop()
 
     # Compute statistics Throughput: Track successful transmissions and their packet sizes. Calculate the total
     # number of bits transmitted per unit time.
@@ -88,8 +133,102 @@ def sim_aloha(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
     return throughput, collision_rate, successful_tx, delay, lost_packets
 
 
-def run_simulations(num_stations, cfg, logger):
-    logger.info("[ALOHA] :: Running %d simulations with %d stations" % (cfg.num_runs, num_stations))
+def sim_aloha_vectorized(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
+    """
+    Array based counterpart of sim_aloha: the stations of every replication are held in a StationTable
+    of shape (num_runs, num_stations) and each epoch advances all the replications at once.
+    packet_probs and packet_sizes are (num_runs, num_stations) arrays, rng_ is a numpy Generator.
+    Each returned metric is an array holding one value per replication.
+    """
+    num_runs = packet_probs.shape[0]
+
+    # Init stations
+    stations = StationTable(packet_probs, packet_sizes, cfg.max_backoff_time)
+
+    # Per replication counters
+    total_transmissions = np.zeros(num_runs, dtype=np.int64)
+    collisions = np.zeros(num_runs, dtype=np.int64)
+    transmission_size = np.zeros(num_runs, dtype=np.int64)
+
+    # Time advances with fixed increments
+    for epoch in range(cfg.num_epochs):
+
+        # Only for debug purposes
+        if (epoch + 1) % 1000 == 0:
+            logger.debug(("Processing %d epoch" % (epoch + 1)))
+
+        # Stations ready to transmit a frame
+        transmitting = stations.has_frame_to_transmit(rng_)
+
+        # Stations waiting for the backoff time to be over
+        waiting = stations.is_waiting()
+
+        # Keep count of total transmission
+        n_tx = transmitting.sum(axis=1)
+        total_transmissions += n_tx
+
+        # Replications where at least one node is transmitting, in the others nothing happens
+        busy = n_tx > 0
+        if not busy.any():
+            continue
+
+        # Start transmission: every transmitting station puts its packet on the channel
+        stations.start_tx(transmitting)
+        transmission_size += (stations.packet_size * transmitting).sum(axis=1)
+
+        # Only one node is trying to transmit on the channel: ack the sender
+        stations.get_ack(transmitting & (n_tx == 1)[:, None])
+
+        # Multiple nodes are trying to send over the channel, this lead to a collision
+        collided = n_tx > 1
+        # Each colliding station increments the collisions' counter by the number of transmitting nodes
+        collisions += np.where(collided, n_tx * n_tx, 0)
+        stations.handle_collision(transmitting & collided[:, None], rng_)
+
+        # Decrease waiting time for stations in WAIT state, only in replications where the channel was used
+        # Once waiting time is back to 0 the station will be ready to retransmit the package
+        stations.decrease_waiting_time(waiting & busy[:, None])
+
+    throughput = transmission_size / cfg.num_epochs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        collision_rate = collisions / total_transmissions
+    successful_tx = total_transmissions
+    delay = stations.waiting_time.mean(axis=1)
+    lost_packets = stations.lost_packets.mean(axis=1)
+
+    return throughput, collision_rate, successful_tx, delay, lost_packets
+
+
+def run_vectorized_replications(num_stations, cfg, seeds, logger):
+    # A single numpy Generator, seeded by the streams of the whole chunk, feeds all its replications
+    rng_ = np.random.default_rng(seeds)
+
+    # Generate rvs for each station of each replication
+    packet_probs = rng_.uniform(*cfg.packet_prob_ranges['aloha'], (len(seeds), num_stations))
+    packet_sizes = rng_.integers(*cfg.packet_size_range, (len(seeds), num_stations), endpoint=True)
+
+    tput, c_rate, tx_pack, delay, l_packs = sim_aloha_vectorized(num_stations, cfg, packet_probs,
+                                                                 packet_sizes, rng_, logger)
+
+    return {
+        "throughput": tput
+        , "collision_rate": c_rate
+        , "delay": delay
+        , "lost_packets": l_packs
+        , "tx_packets": tx_pack
+    }
+
+
+def run_replications(num_stations, cfg, seeds, logger, first=0):
+    """
+    Run one replication for each of the given seeds, it is the unit of work of runner.run_simulations. first is the
+    index of the first of these replications in the simulation
+    """
+    if cfg.engine == 'vectorized':
+        return run_vectorized_replications(num_stations, cfg, seeds, logger)
+
+    # The event driven kernel shares the same per-replication set up of the fixed-increment one
+    sim_ = events.sim_aloha_events if cfg.engine == 'event' else sim_aloha
 
     throughput = []
     collision_rates = []
@@ -97,26 +236,28 @@ def run_simulations(num_stations, cfg, logger):
     lost_packets = []
     tx_packets = []
 
-    for _ in range(cfg.num_runs):
+    # Events of the sampled replications are recorded, see tracing.py
+    recorder_ = tracing.recorder(cfg, 'aloha', num_stations)
 
-        # Init Random Number Generator
-        # Independent replications: re-initialize each replication with a different RNG seed
-        # Alternative: initialize with fixed seed in order to ensure reproducibility of the simulation
-        if not cfg.seed or cfg.seed is None or cfg.seed == 'None' or cfg.seed == '':
-            rng_ = rng.RandomNumberGenerator()
-        else:
-            rng_ = rng.RandomNumberGenerator(cfg.seed)
+    for index, seed in enumerate(seeds, first):
 
-        if (_ + 1) % 100 == 0:
-            logger.debug("[ALOHA] :: Run number %d" % (_ + 1))
+        tracer = recorder_.replication(index, seed) if recorder_ else None
 
-        # Generate rvs for each station in the simulated model for the three different categories
-        # TODO: define upper and lower interval bound using the config file
-        packet_probs = [rng_.generate_random_uniform(0.05, 0.2) for _ in range(num_stations)]
-        packet_sizes = [rng_.generate_random_int(1, 3) for _ in range(num_stations)]
+        if cfg.variance_reduction != 'none':
+            # Common random numbers: stations draw from their own streams, the same for both protocols
+            tput, c_rate, tx_pack, delay, l_packs = runner.run_common_replication(sim_, 'aloha', num_stations, cfg,
+                                                                                  seed, logger, tracer)
+        else:
+            # Init Random Number Generator
+            # Independent replications: each replication draws from its own RNG stream
+            rng_ = profiling.counting(rng.create_generator(seed, cfg.rng_backend), 'aloha')
+
+            # Generate rvs for each station in the simulated model for the three different categories
+            packet_probs = [rng_.generate_random_uniform(*cfg.packet_prob_ranges['aloha']) for _ in range(num_stations)]
+            packet_sizes = [rng_.generate_random_int(*cfg.packet_size_range) for _ in range(num_stations)]
 
-        tput, c_rate, tx_pack, delay, l_packs = sim_aloha(num_stations, cfg, packet_probs,
-                                                          packet_sizes, rng_, logger)
+            tput, c_rate, tx_pack, delay, l_packs = sim_(num_stations, cfg, packet_probs,
+                                                         packet_sizes, rng_, logger, tracer)
 
         # Update simulation's sampled data
         throughput.append(tput)
@@ -125,6 +266,9 @@ def run_simulations(num_stations, cfg, logger):
         lost_packets.append(l_packs)
         tx_packets.append(tx_pack)
 
+    if recorder_:
+        recorder_.flush()
+
     return {
         "throughput": throughput
         , "collision_rate": collision_rates
@@ -134,7 +278,19 @@ def run_simulations(num_stations, cfg, logger):
     }
 
 
+def run_simulations(num_stations, cfg, logger):
+    logger.info("[ALOHA] :: Running %d simulations with %d stations" % (cfg.num_runs, num_stations))
+
+    params = {'packet_prob_range': cfg.packet_prob_ranges['aloha'], 'packet_size_range': cfg.packet_size_range}
+    return cache.run_cached('aloha', num_stations, cfg, params,
+                            lambda: runner.run_simulations('aloha', run_replications, num_stations, cfg, logger),
+                            logger)
+
+
 def main():
+    # The analysis and plotting stack is only loaded to run the whole simulation, not by the worker processes
+    import simulations
+
     # Run simulations from the method defined in simulation.py
     simulations.start_simulations(['aloha'])
 
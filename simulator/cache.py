@@ -0,0 +1,149 @@
+import functools
+import glob
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+import config
+import rng
+import store
+import telemetry
+
+# Modules the simulation results depend on: any change to them invalidates the cached results
+CODE_MODULES = ('aloha', 'csma', 'channel', 'station', 'events', 'rng', 'runner')
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """Digest of the source code of the simulator modules"""
+    h = hashlib.sha256()
+    for name in CODE_MODULES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name + '.py'), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def cache_key(protocol, num_stations, cfg, params):
+    """
+    Digest of everything the results of a simulation depend on: protocol, number of stations, configuration,
+    seed, the protocol's params (e.g. packet probability and size ranges) and the simulator code version
+    """
+    key = dict(store.config_key(cfg), protocol=protocol, num_stations=num_stations, num_runs=cfg.num_runs,
+               params=params, code=code_version())
+    if cfg.sequential:
+        key.update(target_precision=cfg.target_precision, max_runs=cfg.max_runs,
+                   sequential_batch=cfg.sequential_batch, sequential_metrics=cfg.sequential_metrics)
+
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of the results of whole simulations, one .npz file per key holding the results
+    buffer returned by runner.run_simulations. Least recently used entries are evicted once the cache grows larger
+    than max_bytes: the modification time of an entry is updated every time it is read.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def entries(self):
+        return glob.glob(os.path.join(self.path, '*.npz'))
+
+    def get(self, key):
+        """Cached results of the given key, as returned by runner.run_simulations, or None"""
+        fname = self.entry_path(key)
+        try:
+            with np.load(fname) as data:
+                res = data['results']
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Most recently used
+        os.utime(fname)
+        return res
+
+    def put(self, key, res):
+        # Write to a temporary file first, so that concurrent or interrupted simulations never leave a partial entry
+        fname = self.entry_path(key)
+        tmp = fname + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, results=res)
+        os.replace(tmp, fname)
+
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits into max_bytes"""
+        entries = sorted((os.stat(fname).st_mtime, os.path.getsize(fname), fname) for fname in self.entries())
+        size = sum(s for _, s, _ in entries)
+        for _, s, fname in entries:
+            if size <= self.max_bytes:
+                break
+            os.remove(fname)
+            size -= s
+
+    def clear(self):
+        """Invalidate the whole cache, returning the number of entries removed"""
+        entries = self.entries()
+        for fname in entries:
+            os.remove(fname)
+        return len(entries)
+
+    def size(self):
+        return sum(os.path.getsize(fname) for fname in self.entries())
+
+
+def run_cached(protocol, num_stations, cfg, params, run_simulations, logger):
+    """
+    Results of run_simulations(), served from the cache when the very same simulation was already run.
+    The cache is bypassed when disabled, for unseeded simulations, whose results are not reproducible even if their
+    root seed was drawn at run time, in streaming mode, which does not return the samples, and when the runs are
+    traced or stored: trace files and run store are written by the runs, a cache hit would leave them out.
+    """
+    if (not cfg.cache or cfg.streaming or cfg.trace or cfg.store or rng.parse_seed(cfg.seed) is None
+            or cfg.seed_drawn):
+        return run_simulations()
+
+    cache_ = ResultCache(cfg.cache_dir, cfg.cache_max_bytes)
+    key = cache_key(protocol, num_stations, cfg, params)
+
+    res = cache_.get(key)
+    if res is not None:
+        logger.info("[%s] :: Results of %d stations served from cache %s" % (protocol.upper(), num_stations, key[:16]))
+        # The cached runs count as completed ones, as if they were run
+        telemetry.running(protocol, num_stations)
+        telemetry.advance(len(res), len(res) * cfg.num_epochs)
+        return res
+
+    res = run_simulations()
+    cache_.put(key, res)
+
+    return res
+
+
+def main():
+    # Usage: python simulator/cache.py [info|clear]
+    cfg = config.Config('./config.ini')
+    cache_ = ResultCache(cfg.cache_dir, cfg.cache_max_bytes)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'info'
+
+    if command == 'clear':
+        print("Removed %d cached simulations from %s" % (cache_.clear(), cfg.cache_dir))
+    elif command == 'info':
+        print("%d cached simulations in %s, %.1f of %.1f MB" % (len(cache_.entries()), cfg.cache_dir,
+                                                               cache_.size() / 2 ** 20, cfg.cache_max_bytes / 2 ** 20))
+    else:
+        sys.exit("Unknown command %s, expected info or clear" % command)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,14 @@
 import configparser
+import os
+import time
+
+
+def parse_range(value, type_):
+    """Lower and upper bound of a comma separated interval, e.g. 0.05,0.2"""
+    lower, upper = (type_(v) for v in value.split(','))
+    if lower > upper:
+        raise ValueError("Empty interval %s" % value)
+    return lower, upper
 
 
 class Config:
@@ -21,5 +31,111 @@ class Config:
         self.max_backoff_time = int(config[section]['MaxBackoffTime'])
         self.list_num_stations = [int(ns) for ns in config[section]['NumStations'].strip().split(',')]
         self.seed = config.get(section, 'Seed').strip()
+        # Set when the root seed of an unseeded simulation is drawn at run time, e.g. for common random numbers:
+        # its results are not reproducible all the same, so they are neither cached nor resumed
+        self.seed_drawn = False
         self.is_debug = config.getboolean(section,'IsDebug')
+        # Bounds of the uniform distributions of the packet probability of each station, per protocol,
+        # and of its packet size, optional
+        self.packet_prob_ranges = {
+            'aloha': parse_range(config.get(section, 'AlohaPacketProb', fallback='0.05,0.2'), float)
+            , 'csma': parse_range(config.get(section, 'CsmaPacketProb', fallback='0.05,0.4'), float)
+        }
+        self.packet_size_range = parse_range(config.get(section, 'PacketSize', fallback='1,3'), int)
+        # Simulation engine, optional: object (default), vectorized or event
+        self.engine = config.get(section, 'Engine', fallback='object').strip().lower()
+
+        if self.engine not in ('object', 'vectorized', 'event'):
+            raise ValueError("Engine %s not supported" % self.engine)
+
+        # Variance reduction, optional: none (default), crn (common random numbers) or antithetic (crn along with
+        # antithetic variates), supported by the object engine only
+        self.variance_reduction = config.get(section, 'VarianceReduction', fallback='none').strip().lower()
+
+        if self.variance_reduction not in ('none', 'crn', 'antithetic'):
+            raise ValueError("Variance reduction %s not supported" % self.variance_reduction)
+        if self.variance_reduction != 'none' and self.engine != 'object':
+            raise ValueError("Variance reduction %s not supported by the %s engine" % (self.variance_reduction,
+                                                                                      self.engine))
+
+        # Random Number Generator backend, optional: python (default) or buffered
+        self.rng_backend = config.get(section, 'RngBackend', fallback='python').strip().lower()
+
+        if self.rng_backend not in ('python', 'buffered'):
+            raise ValueError("RNG backend %s not supported" % self.rng_backend)
+
+        # Maximum vertical error of the downsampled ECDF and Lorenz curve plots, optional: 0 draws every sample
+        self.plot_max_error = config.getfloat(section, 'PlotMaxError', fallback=0.0)
+
+        # Number of worker processes rendering the plots in background, optional
+        self.plot_workers = config.getint(section, 'PlotWorkers', fallback=1)
+
+        # Parallel execution, optional: number of worker processes and replications per unit of work
+        self.workers = config.getint(section, 'Workers', fallback=1)
+        self.chunk_size = config.getint(section, 'ChunkSize', fallback=100)
+
+        # Distributed execution, optional: chunks of runs are served to the workers connected to the coordinator
+        self.distributed = config.getboolean(section, 'Distributed', fallback=False)
+        self.coordinator_address = config.get(section, 'CoordinatorAddress', fallback='127.0.0.1:50000').strip()
+        self.distributed_authkey = config.get(section, 'DistributedAuthKey', fallback='aloha-csma').strip()
+        self.lease_timeout = config.getfloat(section, 'LeaseTimeout', fallback=60)
+        self.local_workers = config.getint(section, 'LocalWorkers', fallback=0)
+
+        # Profiling, optional: per-phase timers and counters are written to the data directory at the end of the run
+        self.profile = config.getboolean(section, 'Profile', fallback=False)
+
+        # Telemetry, optional: progress metrics in the Prometheus text format are written to TelemetryPath at most
+        # once every TelemetryInterval seconds, and served on http://127.0.0.1:TelemetryPort if the port is not 0
+        self.telemetry = config.getboolean(section, 'Telemetry', fallback=False)
+        self.telemetry_path = config.get(section, 'TelemetryPath', fallback='./data/telemetry.prom').strip()
+        self.telemetry_interval = config.getfloat(section, 'TelemetryInterval', fallback=1.0)
+        self.telemetry_port = config.getint(section, 'TelemetryPort', fallback=0)
+
+        # Trace recorder, optional: events of one replication every TraceEvery, all or only collisions, are written
+        # into a new directory under TracePath
+        self.trace = config.getboolean(section, 'Trace', fallback=False)
+        self.trace_path = os.path.join(config.get(section, 'TracePath', fallback='./data/traces').strip(),
+                                       time.strftime("%Y%m%d-%H%M%S"))
+        self.trace_every = config.getint(section, 'TraceEvery', fallback=1)
+        self.trace_events = config.get(section, 'TraceEvents', fallback='all').strip().lower()
+
+        if self.trace_events not in ('all', 'collisions'):
+            raise ValueError("Trace events %s not supported" % self.trace_events)
+        if self.trace and self.engine == 'vectorized':
+            raise ValueError("Trace not supported by the vectorized engine")
+
+        # Streaming statistics, optional: results are accumulated online instead of being held in memory
+        self.streaming = config.getboolean(section, 'Streaming', fallback=False)
+        self.streaming_sample_size = config.getint(section, 'StreamingSampleSize', fallback=10000)
+
+        # Raw per-run results store, optional: completed chunks of runs are persisted and not run again
+        self.store = config.getboolean(section, 'Store', fallback=False)
+        self.store_path = config.get(section, 'StorePath', fallback='./data/runs').strip()
+
+        # Sequential stopping rule, optional: runs go on in batches until the confidence intervals are tight enough
+        self.sequential = config.getboolean(section, 'Sequential', fallback=False)
+        self.target_precision = config.getfloat(section, 'TargetPrecision', fallback=0.05)
+        self.max_runs = config.getint(section, 'MaxRuns', fallback=self.num_runs)
+        self.sequential_batch = config.getint(section, 'SequentialBatch', fallback=self.num_runs)
+        self.sequential_metrics = [m.strip() for m in
+                                   config.get(section, 'SequentialMetrics', fallback='throughput').split(',')]
+
+        # Steady-state mode, optional: a single simulation of SteadyEpochs epochs per protocol and number of stations,
+        # whose warm-up is truncated, estimates come from SteadyBatches batch means of windows of SteadyWindow epochs
+        self.steady_state = config.getboolean(section, 'SteadyState', fallback=False)
+        self.steady_epochs = config.getint(section, 'SteadyEpochs', fallback=self.num_epochs * 100)
+        self.steady_window = config.getint(section, 'SteadyWindow', fallback=10)
+        self.steady_batches = config.getint(section, 'SteadyBatches', fallback=30)
+
+        # Bootstrap confidence intervals of median, Gini coefficient, CoV and Lorenz curve gap, optional:
+        # BootstrapResamples resamples, 0 to disable, and interval method, bca (default) or percentile
+        self.bootstrap_resamples = config.getint(section, 'BootstrapResamples', fallback=0)
+        self.bootstrap_method = config.get(section, 'BootstrapMethod', fallback='bca').strip().lower()
+
+        if self.bootstrap_method not in ('bca', 'percentile'):
+            raise ValueError("Bootstrap method %s not supported" % self.bootstrap_method)
 
+        # Result cache, optional: seeded simulations already run are served from CacheDir, bounded to CacheMaxMB
+        self.cache = config.getboolean(section, 'Cache', fallback=False)
+        self.cache_dir = config.get(section, 'CacheDir', fallback='./data/cache').strip()
+        self.cache_max_bytes = int(config.getfloat(section, 'CacheMaxMB', fallback=512) * 2 ** 20)
@@ -1,31 +1,47 @@
-import utils
-import simulations
+import numpy as np
+
 import rng
+import runner
+import events
+import cache
+import profiling
+import tracing
 import stats
 import channel
-from station import CsmaStation
+from station import CsmaStation, Station, StationTable, TimerWheel
 
 
-def sim_csma(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
+def sim_csma(num_stations, cfg, packet_probs, packet_sizes, rng_, logger, tracer=None):
     successful_transmissions = 0
     total_transmissions = 0
     collisions = 0
 
     c = channel.Channel()
-    stations = [CsmaStation(i, packet_probs[i], packet_sizes[i], rng_, cfg.max_backoff_time) for i in range(num_stations)]
+    # A single generator shared by all the stations, or one generator per station for common random numbers
+    rngs_ = rng_ if isinstance(rng_, list) else [rng_] * num_stations
+    stations = [CsmaStation(i, packet_probs[i], packet_sizes[i], rngs_[i], cfg.max_backoff_time)
+                for i in range(num_stations)]
+    # Stations waiting for their backoff are held by the wheel, only the other ones are scanned
+    wheel = TimerWheel(stations, cfg.max_backoff_time)
+
+    # Phase timers, None unless profiling is enabled
+    clock = profiling.phase_clock('csma', ('scan', 'transmit', 'countdown'))
 
     # Time advances with fixed increments
     for epoch in range(cfg.num_epochs):
 
-        # List of stations ready to transmit a frame
-        transmitting = [s for s in stations if s.has_frame_to_transmit()]
+        if clock:
+            clock.start()
 
-        # List of nodes waiting for the backoff time to be over
-        waiting = [s for s in stations if s.is_waiting()]
+        # List of stations ready to transmit a frame
+        transmitting = [s for s in wheel.active if s.has_frame_to_transmit()]
 
         # Keep count of total transmission
         total_transmissions += len(transmitting)
 
+        if clock:
+            clock.lap(0)
+
         # Check if there are nodes ready to transmit
         if not transmitting:
             # No nodes ready to start a transmission
@@ -43,10 +59,15 @@ def sim_csma(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
                 c.transmit(epoch, txs.packet_size)
                 # Set sender
                 sender = txs
+                if tracer:
+                    tracer.record(epoch, txs.id, tracing.TX)
 
             else:
                 # Transmitting station waits a random time before trying once again
                 txs.wait()
+                wheel.schedule(txs)
+                if tracer:
+                    tracer.record(epoch, txs.id, tracing.DEFER, txs.backoff_time)
 
         # Deliver the packet, free the channel
         # This update the statistics
@@ -54,13 +75,25 @@ def sim_csma(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
         if sender is not None:
             # Ack the sender
             sender.get_ack()
+            if tracer:
+                tracer.record(epoch, sender.id, tracing.ACK)
+
+        if clock:
+            clock.lap(1)
 
-        # Decrease waiting time for stations in WAIT state, as a way to
-        # simulate the time clock advancing
-        # Once waiting time is back to 0 the station will be
+        # Time advances for stations in WAIT state, the ones which entered it in this epoch excluded
+        # Once waiting time is over the station will be
         # ready to retransmit the package
-        for w in waiting:
-            w.decrease_waiting_time()
+        expired = wheel.advance()
+        if tracer:
+            for w in sorted(expired, key=lambda s: s.id):
+                tracer.record(epoch, w.id, tracing.RESUME)
+
+        if clock:
+            clock.lap(2)
+
+    if clock:
+        clock.stop()
 
     # Compute statistics Throughput: Track successful transmissions and their packet sizes. Calculate the total
     # number of bits transmitted per unit time.
@@ -77,39 +110,124 @@ def sim_csma(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
     return throughput, successful_tx, delay
 
 
-def run_simulations(num_stations, cfg, logger):
-    logger.info("[CSMA]  :: Running %d simulations with %d stations" % (cfg.num_runs, num_stations))
+def sim_csma_vectorized(num_stations, cfg, packet_probs, packet_sizes, rng_, logger):
+    """
+    Array based counterpart of sim_csma: the stations of every replication are held in a StationTable
+    of shape (num_runs, num_stations) and each epoch advances all the replications at once.
+    packet_probs and packet_sizes are (num_runs, num_stations) arrays, rng_ is a numpy Generator.
+    Each returned metric is an array holding one value per replication.
+    """
+    num_runs = packet_probs.shape[0]
+    runs = np.arange(num_runs)
+
+    stations = StationTable(packet_probs, packet_sizes, cfg.max_backoff_time)
+
+    # Per replication channel counters
+    packets = np.zeros(num_runs, dtype=np.int64)
+    transmission_size = np.zeros(num_runs, dtype=np.int64)
+
+    # Time advances with fixed increments
+    for epoch in range(cfg.num_epochs):
+
+        # Stations ready to transmit a frame
+        transmitting = stations.has_frame_to_transmit(rng_)
+
+        # Stations waiting for the backoff time to be over
+        waiting = stations.is_waiting()
+
+        # Replications where at least one node is transmitting, in the others nothing happens
+        busy = transmitting.any(axis=1)
+        if not busy.any():
+            continue
+
+        stations.start_tx(transmitting)
+
+        # First come, first serve: the lowest index ready station finds the channel free and wins it
+        sender = np.zeros_like(transmitting)
+        sender[runs[busy], transmitting.argmax(axis=1)[busy]] = True
+        packets += busy
+        transmission_size += (stations.packet_size * sender).sum(axis=1)
+
+        # Every other ready station senses the channel busy and waits a random time before trying once again
+        stations.wait(transmitting & ~sender, rng_)
+
+        # Ack the sender
+        stations.get_ack(sender)
+
+        # Decrease waiting time for stations in WAIT state, only in replications where the channel was used
+        # Once waiting time is back to 0 the station will be ready to retransmit the package
+        stations.decrease_waiting_time(waiting & busy[:, None])
+
+    throughput = transmission_size / cfg.num_epochs
+    successful_tx = packets
+    delay = stations.waiting_time.mean(axis=1)
+
+    return throughput, successful_tx, delay
+
+
+def run_vectorized_replications(num_stations, cfg, seeds, logger):
+    # A single numpy Generator, seeded by the streams of the whole chunk, feeds all its replications
+    rng_ = np.random.default_rng(seeds)
+
+    # Generate rvs for each station of each replication
+    packet_probs = rng_.uniform(*cfg.packet_prob_ranges['csma'], (len(seeds), num_stations))
+    packet_sizes = rng_.integers(*cfg.packet_size_range, (len(seeds), num_stations), endpoint=True)
+
+    tput, tx_pack, delay = sim_csma_vectorized(num_stations, cfg, packet_probs, packet_sizes, rng_, logger)
+
+    return {
+        "throughput": tput
+        , "delay": delay
+        , "tx_packets": tx_pack
+    }
+
+
+def run_replications(num_stations, cfg, seeds, logger, first=0):
+    """
+    Run one replication for each of the given seeds, it is the unit of work of runner.run_simulations. first is the
+    index of the first of these replications in the simulation
+    """
+    if cfg.engine == 'vectorized':
+        return run_vectorized_replications(num_stations, cfg, seeds, logger)
+
+    # The event driven kernel shares the same per-replication set up of the fixed-increment one
+    sim_ = events.sim_csma_events if cfg.engine == 'event' else sim_csma
 
     throughput = []
     delays = []
     tx_packets = []
 
-    for _ in range(cfg.num_runs):
+    # Events of the sampled replications are recorded, see tracing.py
+    recorder_ = tracing.recorder(cfg, 'csma', num_stations)
 
-        # Init Random Number Generator
-        # Independent replications: re-initialize each replication with a different RNG seed
-        # Alternative: initialize with fixed seed in order to ensure reproducibility of the simulation
-        if not cfg.seed or cfg.seed is None or cfg.seed == 'None' or cfg.seed == '':
-            rng_ = rng.RandomNumberGenerator()
-        else:
-            rng_ = rng.RandomNumberGenerator(cfg.seed)
+    for index, seed in enumerate(seeds, first):
 
-        if (_ + 1) % 100 == 0:
-            logger.debug("[ALOHA] :: Run number %d" % (_ + 1))
+        tracer = recorder_.replication(index, seed) if recorder_ else None
 
-        # Generate rvs for each station in the simulated model for the three different categories
-        # TODO: define upper and lower interval bound using the config file
-        packet_probs = [rng_.generate_random_uniform(0.05, 0.4) for _ in range(num_stations)]
-        packet_sizes = [rng_.generate_random_int(1, 3) for _ in range(num_stations)]
+        if cfg.variance_reduction != 'none':
+            # Common random numbers: stations draw from their own streams, the same for both protocols
+            tput, tx_pack, delay = runner.run_common_replication(sim_, 'csma', num_stations, cfg, seed, logger,
+                                                                 tracer)
+        else:
+            # Init Random Number Generator
+            # Independent replications: each replication draws from its own RNG stream
+            rng_ = profiling.counting(rng.create_generator(seed, cfg.rng_backend), 'csma')
+
+            # Generate rvs for each station in the simulated model for the three different categories
+            packet_probs = [rng_.generate_random_uniform(*cfg.packet_prob_ranges['csma']) for _ in range(num_stations)]
+            packet_sizes = [rng_.generate_random_int(*cfg.packet_size_range) for _ in range(num_stations)]
 
-        tput, tx_pack, delay = sim_csma(num_stations, cfg, packet_probs,
-                                                          packet_sizes, rng_, logger)
+            tput, tx_pack, delay = sim_(num_stations, cfg, packet_probs,
+                                        packet_sizes, rng_, logger, tracer)
 
         # Update simulation's sampled data
         throughput.append(tput)
         tx_packets.append(tx_pack)
         delays.append(delay)
 
+    if recorder_:
+        recorder_.flush()
+
     return {
         "throughput": throughput
         # ,"collision_rate": None
@@ -119,7 +237,17 @@ def run_simulations(num_stations, cfg, logger):
     }
 
 
+def run_simulations(num_stations, cfg, logger):
+    logger.info("[CSMA]  :: Running %d simulations with %d stations" % (cfg.num_runs, num_stations))
+
+    params = {'packet_prob_range': cfg.packet_prob_ranges['csma'], 'packet_size_range': cfg.packet_size_range}
+    return cache.run_cached('csma', num_stations, cfg, params,
+                            lambda: runner.run_simulations('csma', run_replications, num_stations, cfg, logger), logger)
+
+
 def main():
+    # The analysis and plotting stack is only loaded to run the whole simulation, not by the worker processes
+    import simulations
 
     # Run simulations from the method defined in simulation.py
     simulations.start_simulations(['csma'])
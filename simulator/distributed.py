@@ -0,0 +1,228 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import pickle
+import socket
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+
+import config
+import utils
+
+
+class WorkQueue:
+    """
+    Chunks of replications waiting to be run by the workers, served by the coordinator.
+    A chunk handed to a worker is leased to it: if the worker does not renew the lease within lease_timeout seconds,
+    e.g. because its host went down, the chunk is handed to the next worker asking for one. A chunk may then be run
+    twice, only its first result is kept: both results are the same, each replication drawing from its own RNG stream.
+    """
+
+    def __init__(self, lease_timeout):
+        self.lease_timeout = lease_timeout
+        self.cond = threading.Condition()
+        self.ids = itertools.count()
+        self.tasks = {}
+        self.pending = collections.deque()
+        # Task id -> (worker, lease deadline)
+        self.leases = {}
+        self.results = {}
+        self.errors = {}
+        self.reassigned = 0
+
+    def add_task(self, task):
+        with self.cond:
+            task_id = next(self.ids)
+            self.tasks[task_id] = task
+            self.pending.append(task_id)
+            return task_id
+
+    def reclaim(self):
+        """Put the chunks whose lease is expired back into the queue"""
+        now = time.monotonic()
+        for task_id, (worker, deadline) in list(self.leases.items()):
+            if deadline < now:
+                del self.leases[task_id]
+                self.pending.appendleft(task_id)
+                self.reassigned += 1
+
+    def get_task(self, worker):
+        """Next chunk to be run by the given worker, as a (task id, pickled task) pair, or None if there is none"""
+        with self.cond:
+            self.reclaim()
+            while self.pending:
+                task_id = self.pending.popleft()
+                if task_id in self.tasks:
+                    self.leases[task_id] = (worker, time.monotonic() + self.lease_timeout)
+                    return task_id, self.tasks[task_id]
+            return None
+
+    def lease_interval(self):
+        """Seconds between two renewals of a lease by a worker, several renewals fit into a lease timeout"""
+        return self.lease_timeout / 3
+
+    def renew(self, task_id, worker):
+        """Heartbeat of a worker still running the given chunk"""
+        with self.cond:
+            if self.leases.get(task_id, (None,))[0] == worker:
+                self.leases[task_id] = (worker, time.monotonic() + self.lease_timeout)
+
+    def put_result(self, task_id, worker, result):
+        with self.cond:
+            if task_id in self.tasks:
+                del self.tasks[task_id]
+                self.leases.pop(task_id, None)
+                self.results[task_id] = result
+                self.cond.notify_all()
+
+    def put_error(self, task_id, worker, error):
+        with self.cond:
+            if task_id in self.tasks:
+                del self.tasks[task_id]
+                self.leases.pop(task_id, None)
+                self.errors[task_id] = "worker %s: %s" % (worker, error)
+                self.cond.notify_all()
+
+    def wait_result(self, task_id):
+        """Block until the result of the given chunk is pushed by a worker, then return it"""
+        with self.cond:
+            while task_id not in self.results and task_id not in self.errors:
+                # Wake up from time to time to reclaim the chunks of lost workers, even if no worker asks for one
+                self.cond.wait(self.lease_timeout / 4)
+                self.reclaim()
+            if task_id in self.errors:
+                raise RuntimeError("Chunk %d failed on %s" % (task_id, self.errors.pop(task_id)))
+            return self.results.pop(task_id)
+
+
+class QueueManager(BaseManager):
+    pass
+
+
+# Workers only connect to the coordinator's queue, the callable is registered by the coordinator
+QueueManager.register('work_queue')
+
+
+def parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def compact(res):
+    """Results of a chunk as NumPy arrays, cheaper to send over the network than lists of Python numbers"""
+    return {metric: np.asarray(values) for metric, values in res.items()}
+
+
+def run_worker(address, authkey, poll_interval=0.5):
+    """
+    Worker loop: pull chunks from the coordinator at the given address, run them and push back their results,
+    until the coordinator goes away
+    """
+    worker = '%s-%d' % (socket.gethostname(), os.getpid())
+    logger = utils.init_logger('worker')
+
+    manager = QueueManager(address=address, authkey=authkey)
+    manager.connect()
+    queue_ = manager.work_queue()
+    logger.info("[WORKER] :: %s connected to %s:%d" % (worker, *address))
+
+    try:
+        while True:
+            task = queue_.get_task(worker)
+            if task is None:
+                time.sleep(poll_interval)
+                continue
+
+            task_id, payload = task
+            run_replications, num_stations, cfg, seeds, first = pickle.loads(payload)
+
+            # Renew the lease of the chunk while it runs, so that it is not handed to another worker
+            running = threading.Event()
+            heartbeat = threading.Thread(target=renew_lease, args=(queue_, task_id, worker, running), daemon=True)
+            heartbeat.start()
+            try:
+                res = run_replications(num_stations, cfg, seeds, logger, first)
+                queue_.put_result(task_id, worker, compact(res))
+            except Exception:
+                queue_.put_error(task_id, worker, traceback.format_exc())
+            finally:
+                running.set()
+                heartbeat.join()
+    except (EOFError, ConnectionError):
+        logger.info("[WORKER] :: %s disconnected, coordinator is gone" % worker)
+
+
+def renew_lease(queue_, task_id, worker, done):
+    interval = queue_.lease_interval()
+    while not done.wait(interval):
+        queue_.renew(task_id, worker)
+
+
+class Coordinator:
+    """
+    Serves the chunks of replications of run_simulations to worker processes, local or on other hosts, connected
+    over TCP through a multiprocessing manager. It stands in for the process pool of runner.run_chunks.
+    """
+
+    def __init__(self, address, authkey, lease_timeout=60, local_workers=0):
+        self.queue = WorkQueue(lease_timeout)
+        # The queue is a shared object of this process, the manager's server serving it from a background thread
+        QueueManager.register('work_queue', callable=lambda: self.queue)
+        self.manager = QueueManager(address=address, authkey=authkey)
+        self.server = self.manager.get_server()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.address = self.server.address
+
+        # Local worker processes, e.g. to test the distributed mode on a single machine
+        self.local_workers = [multiprocessing.Process(target=run_worker, args=(('127.0.0.1', self.address[1]), authkey),
+                                                      daemon=True)
+                              for _ in range(local_workers)]
+        for p in self.local_workers:
+            p.start()
+
+    def map(self, run_replications, num_stations_, cfg_, chunks, logger_, firsts):
+        """Same as ProcessPoolExecutor.map: every chunk is queued at once, results are returned in order"""
+        task_ids = [self.queue.add_task(pickle.dumps((run_replications, num_stations, cfg, chunk, first)))
+                    for num_stations, cfg, chunk, first in zip(num_stations_, cfg_, chunks, firsts)]
+
+        return (self.queue.wait_result(task_id) for task_id in task_ids)
+
+
+# One coordinator per process, shared by all the simulations
+_coordinator = None
+
+
+def get_coordinator(cfg, logger):
+    """Coordinator of the current process, started at the first call"""
+    global _coordinator
+    if _coordinator is None:
+        _coordinator = Coordinator(parse_address(cfg.coordinator_address), cfg.distributed_authkey.encode(),
+                                   cfg.lease_timeout, cfg.local_workers)
+        logger.info("[COORDINATOR] :: Serving chunks on %s:%d, %d local workers" % (*_coordinator.address,
+                                                                                 cfg.local_workers))
+    return _coordinator
+
+
+def main():
+    # Usage: python simulator/distributed.py [host:port] [processes]
+    # Starts worker processes pulling chunks from the coordinator, CoordinatorAddress of config.ini by default
+    cfg = config.Config('./config.ini')
+    address = parse_address(sys.argv[1] if len(sys.argv) > 1 else cfg.coordinator_address)
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    workers = [multiprocessing.Process(target=run_worker, args=(address, cfg.distributed_authkey.encode()))
+               for _ in range(processes)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()
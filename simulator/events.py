@@ -0,0 +1,200 @@
+import heapq
+import math
+
+import tracing
+
+
+def next_frame(epoch, log_q, rng_):
+    """
+    Epoch in which an IDLE station, idle since the given epoch, has a new frame to transmit.
+    Testing a new frame with probability p at each epoch is the same as drawing the number of epochs
+    until the first success from a geometric distribution, log_q being log(1 - p).
+    A station with p <= 0, log_q being 0, never has a new frame: its next frame is at infinity.
+    """
+    if not log_q:
+        return math.inf
+    return epoch + int(math.log(1.0 - rng_.generate_random()) / log_q) + 1
+
+
+def log_complement(p):
+    """log(1 - p) of a packet probability, -inf for p >= 1 so that a new frame comes at the next epoch"""
+    if p <= 0:
+        return 0.0
+    if p >= 1:
+        return -math.inf
+    return math.log(1.0 - p)
+
+
+def init_calendar(packet_probs, rng_):
+    """Schedule the first frame of every station, all of them being IDLE at the beginning of the simulation"""
+    log_qs = [log_complement(p) for p in packet_probs]
+    calendar = [(next_frame(-1, log_q, rng_), i) for i, log_q in enumerate(log_qs)]
+    heapq.heapify(calendar)
+
+    return calendar, log_qs
+
+
+def pop_transmitting(calendar):
+    """Pop from the calendar all the stations transmitting in the next busy epoch"""
+    epoch, i = heapq.heappop(calendar)
+    transmitting = [i]
+    while calendar and calendar[0][0] == epoch:
+        transmitting.append(heapq.heappop(calendar)[1])
+
+    return epoch, transmitting
+
+
+def sim_aloha_events(num_stations, cfg, packet_probs, packet_sizes, rng_, logger, tracer=None, series=None, window=1):
+    """
+    Next-event counterpart of aloha.sim_aloha. The calendar holds the epoch of the next transmission of each
+    station not waiting for its backoff, and time jumps from one busy epoch to the next one.
+    As in the fixed-increment loop the backoff of a waiting station only counts down in epochs in which
+    the channel is used, so backoff expiries are indexed by the number of busy epochs elapsed.
+    rng_ is one of the generators in rng.py, tracer a tracing.TraceRecorder or None.
+    If a series list is given, the cumulative counters (transmission size, transmissions, collisions, waiting time,
+    lost packets) are appended to it at the end of every window of epochs, see steady.py. The series of a run stalled
+    with every station waiting ends at the stall.
+    """
+    total_transmissions = 0
+    collisions = 0
+    transmission_size = 0
+
+    packet_attempt = [0] * num_stations
+    waiting_time = [0] * num_stations
+    lost_packets = [0] * num_stations
+
+    calendar, log_qs = init_calendar(packet_probs, rng_)
+    # Busy epoch index -> stations whose backoff is over at that busy epoch
+    expiries = {}
+    busy_epochs = 0
+
+    while calendar and calendar[0][0] < cfg.num_epochs:
+
+        epoch, transmitting = pop_transmitting(calendar)
+        busy_epochs += 1
+
+        if series is not None:
+            while epoch >= (len(series) + 1) * window:
+                series.append((transmission_size, total_transmissions, collisions, sum(waiting_time),
+                               sum(lost_packets)))
+
+        # Keep count of total transmission
+        total_transmissions += len(transmitting)
+
+        for i in transmitting:
+            packet_attempt[i] += 1
+            transmission_size += packet_sizes[i]
+            if tracer:
+                tracer.record(epoch, i, tracing.TX)
+
+        if len(transmitting) == 1:
+            # Only one node is trying to transmit on the channel, the station is acked and back IDLE
+            i = transmitting[0]
+            packet_attempt[i] = 0
+            heapq.heappush(calendar, (next_frame(epoch, log_qs[i], rng_), i))
+            if tracer:
+                tracer.record(epoch, i, tracing.ACK)
+        else:
+            # Multiple nodes are trying to send over the channel, this lead to a collision
+            collisions += len(transmitting) * len(transmitting)
+
+            for i in transmitting:
+                # Random exponential backoff time
+                backoff_time = rng_.generate_random_int(0, (2 ** packet_attempt[i]) - 1)
+
+                if not backoff_time:
+                    # Ready to re-transmit in the next epoch
+                    heapq.heappush(calendar, (epoch + 1, i))
+                elif backoff_time > cfg.max_backoff_time:
+                    # Maximum backoff time exceeded, packet is dropped and the station is back IDLE
+                    lost_packets[i] += 1
+                    packet_attempt[i] = 0
+                    heapq.heappush(calendar, (next_frame(epoch, log_qs[i], rng_), i))
+                else:
+                    waiting_time[i] += backoff_time
+                    expiries.setdefault(busy_epochs + backoff_time, []).append(i)
+
+                if tracer:
+                    # As in the object engine, a dropped packet is traced with no backoff time
+                    dropped = backoff_time > cfg.max_backoff_time
+                    tracer.record(epoch, i, tracing.DROP if dropped else tracing.COLLISION,
+                                  0 if dropped else backoff_time)
+
+        # Stations whose backoff time is over are ready to re-transmit in the next epoch
+        for i in expiries.pop(busy_epochs, ()):
+            heapq.heappush(calendar, (epoch + 1, i))
+            if tracer:
+                tracer.record(epoch, i, tracing.RESUME)
+
+    if series is not None and calendar:
+        while len(series) < cfg.num_epochs // window:
+            series.append((transmission_size, total_transmissions, collisions, sum(waiting_time), sum(lost_packets)))
+
+    throughput = transmission_size / cfg.num_epochs
+    collision_rate = collisions / total_transmissions
+    successful_tx = total_transmissions
+    delay = sum(waiting_time) / num_stations
+    lost_packets = sum(lost_packets) / num_stations
+
+    return throughput, collision_rate, successful_tx, delay, lost_packets
+
+
+def sim_csma_events(num_stations, cfg, packet_probs, packet_sizes, rng_, logger, tracer=None, series=None, window=1):
+    """
+    Next-event counterpart of csma.sim_csma, see sim_aloha_events.
+    Among the stations transmitting in the same epoch the lowest index one gets the channel.
+    The cumulative counters of a series are the transmission size, the packets sent and the waiting time.
+    """
+    packets = 0
+    transmission_size = 0
+
+    waiting_time = [0] * num_stations
+
+    calendar, log_qs = init_calendar(packet_probs, rng_)
+    # Busy epoch index -> stations whose backoff is over at that busy epoch
+    expiries = {}
+    busy_epochs = 0
+
+    while calendar and calendar[0][0] < cfg.num_epochs:
+
+        epoch, transmitting = pop_transmitting(calendar)
+        busy_epochs += 1
+
+        if series is not None:
+            while epoch >= (len(series) + 1) * window:
+                series.append((transmission_size, packets, sum(waiting_time)))
+
+        # First come, first serve: the lowest index station senses the channel free
+        sender = min(transmitting)
+        packets += 1
+        transmission_size += packet_sizes[sender]
+        heapq.heappush(calendar, (next_frame(epoch, log_qs[sender], rng_), sender))
+        if tracer:
+            tracer.record(epoch, sender, tracing.TX)
+            tracer.record(epoch, sender, tracing.ACK)
+
+        # Every other station senses the channel busy and waits a random time before trying once again
+        for i in sorted(transmitting):
+            if i == sender:
+                continue
+            backoff_time = rng_.generate_random_int(1, cfg.max_backoff_time)
+            waiting_time[i] += backoff_time
+            expiries.setdefault(busy_epochs + backoff_time, []).append(i)
+            if tracer:
+                tracer.record(epoch, i, tracing.DEFER, backoff_time)
+
+        # Stations whose backoff time is over are ready to re-transmit in the next epoch
+        for i in expiries.pop(busy_epochs, ()):
+            heapq.heappush(calendar, (epoch + 1, i))
+            if tracer:
+                tracer.record(epoch, i, tracing.RESUME)
+
+    if series is not None and calendar:
+        while len(series) < cfg.num_epochs // window:
+            series.append((transmission_size, packets, sum(waiting_time)))
+
+    throughput = transmission_size / cfg.num_epochs
+    successful_tx = packets
+    delay = sum(waiting_time) / num_stations
+
+    return throughput, successful_tx, delay
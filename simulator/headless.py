@@ -0,0 +1,65 @@
+# Compute-only entry point: runs the simulations and prints out the statistics tables, without any plot
+# Usage: python simulator/headless.py [protocols], comma separated, aloha,csma by default
+import os
+import resource
+import sys
+import time
+
+# Headless jobs never touch a display, even if something gets to import matplotlib
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+_start = time.perf_counter()
+
+import config
+import profiling
+import simulations
+import utils
+
+# Cold start: time spent importing the simulation core
+IMPORT_SECONDS = time.perf_counter() - _start
+
+# Plotting and fitting stack, none of it is needed to simulate
+HEAVY_MODULES = ('matplotlib', 'seaborn', 'pandas', 'scipy')
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident set size, in MB, of this process or of the largest of its terminated child processes"""
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return resource.getrusage(who).ru_maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+def main():
+    protocols = [p.strip().lower() for p in sys.argv[1].split(',')] if len(sys.argv) > 1 else ['aloha', 'csma']
+
+    # Retrieve the configuration parameters for this simulation
+    cfg = config.Config('./config.ini')
+
+    # Create logger
+    log_ = utils.init_logger(is_debug=cfg.is_debug)
+
+    profiling.enable(cfg.profile)
+
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    log_.info("[HEADLESS] :: Simulation core imported in %.3f s, %.1f MB resident, plotting and fitting modules "
+              "loaded: %s" % (IMPORT_SECONDS, peak_rss_mb(), ', '.join(loaded) or 'none'))
+
+    # Same simulations and statistics as the plotting entry point, see simulations.start_simulations
+    rows = simulations.compute_all_stats(simulations.run_protocols(protocols, cfg, log_), cfg, log_)
+
+    # Print overall stats in a table-fashioned way, saved to file system only if log level is not DEBUG
+    utils.print_tables(rows, log_, not cfg.is_debug, name='headless')
+
+    # getrusage only accounts the terminated worker processes: the pool of every simulation is shut down by
+    # runner.run_simulations, so all its workers are by now, while the local workers of a coordinator never are
+    if cfg.workers > 1 and not cfg.distributed:
+        log_.info("[HEADLESS] :: Peak resident memory %.1f MB, %.1f MB for the largest terminated worker process" %
+                  (peak_rss_mb(), peak_rss_mb(resource.RUSAGE_CHILDREN)))
+    else:
+        log_.info("[HEADLESS] :: Peak resident memory %.1f MB" % peak_rss_mb())
+
+    if cfg.profile:
+        profiling.write_report('./data/%s-profile.dat' % (time.strftime("%Y%m%d-%H%M")), log_)
+
+
+if __name__ == "__main__":
+    main()
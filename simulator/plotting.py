@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import pickle
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib import pyplot as plt
+
+import profiling
+import stats
+
+
+def init_worker():
+    """Plot workers render off-screen with a non-interactive backend: plt.show() does nothing"""
+    import matplotlib
+    matplotlib.use('Agg')
+    warnings.filterwarnings('ignore', message='.*non-interactive.*')
+
+
+def render(func_name, args, kwargs, profile=False):
+    """
+    Run the given plot function of the stats module, then release its figures.
+    If profile is set the timers collected meanwhile are returned along with the function's result.
+    """
+    if profile:
+        profiling.enable()
+        profiling.reset()
+    try:
+        with profiling.timer('plot.' + func_name):
+            res = getattr(stats, func_name)(*args, **kwargs)
+    finally:
+        plt.close('all')
+
+    return (res, profiling.snapshot()) if profile else res
+
+
+def job_key(func_name, args, kwargs):
+    """Digest of a plot job: plot function, input arrays and options"""
+    h = hashlib.sha1(func_name.encode())
+    for a in list(args) + [kwargs[k] for k in sorted(kwargs)]:
+        if isinstance(a, dict):
+            a = [(k, a[k]) for k in sorted(a)]
+        h.update(pickle.dumps(a))
+    return h.hexdigest()
+
+
+class PlotPipeline:
+    """
+    Renders plots in a background pool of worker processes, so that simulations go on while plots are drawn.
+    Each job is one of the plot functions of the stats module, which receives the arrays it needs only.
+    A plot is skipped when its file exists and was rendered from the very same input, as recorded in the
+    manifest file of the plots directory.
+    With workers set to 0 plots are drawn synchronously in the current process, e.g. to be displayed.
+    """
+
+    def __init__(self, workers=1, manifest='./plots/.manifest.json', logger=None):
+        self.workers = workers
+        self.manifest_path = manifest
+        self.logger = logger
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker) if workers > 0 else None
+        self.jobs = []
+        self.skipped = 0
+
+        try:
+            with open(manifest) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def submit(self, target, func_name, /, *args, **kwargs):
+        """Queue the plot to be saved as the target file, drawn by stats.<func_name>(*args, **kwargs)"""
+        # Lists are turned into arrays, which are cheaper to send to the workers
+        args = [np.asarray(a) if isinstance(a, list) else a for a in args]
+        profiling.count('plot.submitted')
+
+        if self.pool is None:
+            with profiling.timer('plot.' + func_name):
+                return getattr(stats, func_name)(*args, **kwargs)
+
+        key = job_key(func_name, args, kwargs)
+        if self.manifest.get(target) == key and os.path.exists(target):
+            self.skipped += 1
+            return None
+
+        self.jobs.append((target, key, self.pool.submit(render, func_name, args, kwargs, profiling.enabled)))
+        return None
+
+    def close(self):
+        """Wait for all the queued plots and update the manifest"""
+        if self.pool is None:
+            return
+
+        for target, key, job in self.jobs:
+            try:
+                res = job.result()
+                if profiling.enabled:
+                    # Timers of the worker that rendered the plot
+                    res, snapshot = res
+                    profiling.merge(snapshot)
+                self.manifest[target] = key
+                if self.logger is not None:
+                    self.logger.debug("Plot %s rendered%s" % (target, '' if res is None else ' (%s)' % res))
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.error("Can not render plot %s: %s" % (target, e))
+        self.pool.shutdown()
+
+        if self.logger is not None:
+            self.logger.info("Plots: %d rendered, %d up to date" % (len(self.jobs), self.skipped))
+
+        with open(self.manifest_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
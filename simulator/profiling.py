@@ -0,0 +1,176 @@
+import contextlib
+import time
+
+import numpy as np
+
+# Profiling is disabled unless enable() is called, e.g. by start_simulations when Profile is set in config.ini.
+# When disabled, instrumented code only tests this flag, or a None phase clock, and takes the usual path.
+enabled = False
+
+
+class Profiler:
+    """Named timers, each holding the duration of every timed execution, and named counters"""
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+
+    def add(self, name, seconds):
+        self.timers.setdefault(name, []).append(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Timers and counters collected so far, e.g. by a worker process, to be merged into the main profiler"""
+        return {'timers': self.timers, 'counters': self.counters}
+
+    def merge(self, snapshot):
+        for name, durations in snapshot['timers'].items():
+            self.timers.setdefault(name, []).extend(durations)
+        for name, n in snapshot['counters'].items():
+            self.count(name, n)
+
+    def report(self):
+        """Per-phase breakdown rows: name, total, count, mean and 99th percentile of the durations, in seconds"""
+        rows = []
+        for name in sorted(self.timers):
+            d = np.asarray(self.timers[name])
+            rows.append([name, d.sum(), len(d), d.mean(), np.percentile(d, 99)])
+        return rows
+
+
+_profiler = Profiler()
+
+
+def enable(flag=True):
+    global enabled
+    enabled = flag
+
+
+def reset():
+    global _profiler
+    _profiler = Profiler()
+
+
+def timer(name):
+    """Context manager timing its block under the given name, a no-op when profiling is disabled"""
+    return _profiler.timer(name) if enabled else contextlib.nullcontext()
+
+
+def add(name, seconds):
+    if enabled:
+        _profiler.add(name, seconds)
+
+
+def count(name, n=1):
+    if enabled:
+        _profiler.count(name, n)
+
+
+def snapshot():
+    return _profiler.snapshot()
+
+
+def merge(snapshot_):
+    _profiler.merge(snapshot_)
+
+
+class PhaseClock:
+    """
+    Splits the time of a loop into phases: each lap() adds the time elapsed since the previous one to the given
+    phase. Phase totals are recorded once the loop is over, by stop(), so that a timer sample is the time spent in
+    a phase by one whole simulation run rather than by a single epoch.
+    """
+
+    def __init__(self, prefix, phases):
+        self.names = ['%s.%s' % (prefix, p) for p in phases]
+        self.totals = [0.0] * len(phases)
+        self.last = time.perf_counter()
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.totals[phase] += now - self.last
+        self.last = now
+
+    def stop(self):
+        for name, total in zip(self.names, self.totals):
+            _profiler.add(name, total)
+
+
+def phase_clock(prefix, phases):
+    """A new PhaseClock if profiling is enabled, None otherwise"""
+    return PhaseClock(prefix, phases) if enabled else None
+
+
+class CountingGenerator:
+    """Proxy of a Random Number Generator counting the draws of each kind, used when profiling is enabled"""
+
+    def __init__(self, rng_, prefix):
+        self.rng = rng_
+        self.prefix = prefix
+
+    def generate_random(self):
+        _profiler.count(self.prefix + '.draws.random')
+        return self.rng.generate_random()
+
+    def generate_random_int(self, a, b):
+        _profiler.count(self.prefix + '.draws.int')
+        return self.rng.generate_random_int(a, b)
+
+    def generate_random_uniform(self, a, b):
+        _profiler.count(self.prefix + '.draws.uniform')
+        return self.rng.generate_random_uniform(a, b)
+
+
+def counting(rng_, prefix):
+    """The given generator, wrapped into a CountingGenerator if profiling is enabled"""
+    return CountingGenerator(rng_, prefix) if enabled else rng_
+
+
+def run_profiled(run_replications, num_stations, cfg, seeds, logger, first=0):
+    """
+    Run a chunk of replications in a worker process with profiling enabled, returning its results along with
+    the timers and counters collected meanwhile
+    """
+    enable()
+    reset()
+    with timer('runner.chunk'):
+        res = run_replications(num_stations, cfg, seeds, logger, first)
+    return res, snapshot()
+
+
+def merged(output):
+    """Results of a chunk run by run_profiled, whose timers and counters are merged into the current profiler"""
+    res, snapshot_ = output
+    merge(snapshot_)
+    return res
+
+
+def timed(name, func, *args):
+    """Result of func(*args), timed under the given name"""
+    with timer(name):
+        return func(*args)
+
+
+def write_report(fname, logger):
+    """Write the per-phase breakdown and the counters, in the same formats of the stats tables"""
+    from tabulate import tabulate
+    headers_ = ['phase', 'total (s)', 'count', 'mean (s)', 'p99 (s)']
+    table = tabulate(_profiler.report(), headers=headers_, tablefmt="grid", floatfmt=".6f")
+    counters = tabulate(sorted(_profiler.counters.items()), headers=['counter', 'count'], tablefmt="grid")
+
+    logger.info("Profile of the simulation:\n" + table + "\n" + counters)
+    with open(fname, 'w') as f:
+        f.write(table + "\n\n" + counters + "\n")
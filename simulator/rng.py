@@ -1,25 +1,134 @@
 import random
 import sys
+from itertools import chain
+
+import numpy as np
 
 
 # TODO: change it to Singleton pattern
 class RandomNumberGenerator:
     """
-    This class mocks a Random Number Generator by importing the default python random modules.
-    The reason behind the choice to implement this class rather than relying on the random module
-    is to use the same seed for all the draws.
+    This class wraps a Random Number Generator from the default python random module.
+    Each instance owns its own generator state, rather than re-seeding the module-global one,
+    so that several simulations can draw from independent streams in the same process.
     """
 
     def __init__(self, seed=None):
         if seed is None:
             seed = random.SystemRandom().randint(0, sys.maxsize)
-        random.seed(seed)
+        self.random = random.Random(seed)
 
     def generate_random(self):
-        return random.random()
+        return self.random.random()
 
     def generate_random_int(self, a, b):
-        return random.randint(a, b)
+        return self.random.randint(a, b)
 
     def generate_random_uniform(self, a, b):
-        return random.uniform(a, b)
+        return self.random.uniform(a, b)
+
+
+class BufferedRandomNumberGenerator:
+    """
+    Drop-in replacement of RandomNumberGenerator backed by its own numpy Generator.
+    Uniforms and bounded integers are pre-drawn in large blocks and handed out one by one, a new block
+    being drawn once the previous one is exhausted. Draws are served by the C level iterator of the
+    current block, which makes this backend considerably faster for the per-epoch draws of the stations.
+    """
+
+    def __init__(self, seed=None, block_size=4096, int_block_size=512):
+        self.generator = np.random.default_rng(seed)
+        self.block_size = block_size
+        self.int_block_size = int_block_size
+        # Per (a, b) bounds iterators over the blocks of integers
+        self._integers = {}
+        # Bind the draw of a uniform straight to the iterator, bypassing any Python level method call
+        self.generate_random = chain.from_iterable(self._uniform_blocks()).__next__
+
+    def _uniform_blocks(self):
+        while True:
+            yield self.generator.random(self.block_size).tolist()
+
+    def _integer_blocks(self, a, b):
+        while True:
+            yield self.generator.integers(a, b, self.int_block_size, endpoint=True).tolist()
+
+    def generate_random_int(self, a, b):
+        try:
+            return next(self._integers[(a, b)])
+        except KeyError:
+            self._integers[(a, b)] = chain.from_iterable(self._integer_blocks(a, b))
+            return next(self._integers[(a, b)])
+
+    def generate_random_uniform(self, a, b):
+        return a + (b - a) * self.generate_random()
+
+
+class StationStreams:
+    """
+    Random Number Generator of a single station, for common random numbers: station parameters, arrivals and backoff
+    times are drawn from three dedicated streams, derived from the replication seed and the station index only.
+    The k-th arrival or backoff draw of the i-th station of a replication is then the same whatever the protocol and
+    the number of stations, which keeps the simulations being compared in sync.
+    All the draws are obtained from uniforms by inversion; if antithetic is set every uniform u is replaced by 1 - u.
+    """
+
+    def __init__(self, seed, station, antithetic=False):
+        params, arrivals, backoffs = np.random.SeedSequence(seed, spawn_key=(station,)).generate_state(3, np.uint64)
+        self.params = random.Random(int(params))
+        self.arrivals = random.Random(int(arrivals))
+        self.backoffs = random.Random(int(backoffs))
+        self.antithetic = antithetic
+
+    def _uniform(self, stream):
+        u = stream.random()
+        return 1.0 - u if self.antithetic else u
+
+    @staticmethod
+    def _integer(u, a, b):
+        # 1 - u may be 1.0
+        return min(a + int(u * (b - a + 1)), b)
+
+    def generate_random(self):
+        return self._uniform(self.arrivals)
+
+    def generate_random_int(self, a, b):
+        return self._integer(self._uniform(self.backoffs), a, b)
+
+    def generate_random_uniform(self, a, b):
+        return a + (b - a) * self._uniform(self.arrivals)
+
+    def param_uniform(self, a, b):
+        return a + (b - a) * self._uniform(self.params)
+
+    def param_int(self, a, b):
+        return self._integer(self._uniform(self.params), a, b)
+
+
+def station_streams(seed, num_stations, antithetic=False):
+    """Common random numbers generators of the stations of the replication with the given seed"""
+    return [StationStreams(seed, i, antithetic) for i in range(num_stations)]
+
+
+def create_generator(seed=None, backend='python'):
+    """Return a Random Number Generator of the given backend: python or buffered"""
+    if backend == 'buffered':
+        return BufferedRandomNumberGenerator(seed)
+    return RandomNumberGenerator(seed)
+
+
+def parse_seed(seed):
+    """Return the seed set in the config file as an integer, None for independent replications"""
+    if not seed or seed is None or seed == 'None' or seed == '':
+        return None
+    return int(seed)
+
+
+def replication_seeds(seed, num_runs):
+    """
+    Derive one statistically independent seed per replication from the root seed.
+    Seeds are spawned by a numpy SeedSequence, so the i-th seed only depends on the root seed and on i:
+    the same replication gets the same stream no matter how replications are split among workers.
+    """
+    children = np.random.SeedSequence(seed).spawn(num_runs)
+    return [int(c.generate_state(1, np.uint64)[0]) for c in children]
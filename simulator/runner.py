@@ -0,0 +1,200 @@
+import functools
+import math
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+import distributed
+import profiling
+import rng
+import stats
+import store
+import telemetry
+
+
+def split_chunks(seeds, chunk_size):
+    """Split the replication seeds into consecutive chunks of at most chunk_size replications"""
+    return [seeds[i:i + chunk_size] for i in range(0, len(seeds), chunk_size)]
+
+
+def results_buffer(metrics, size):
+    """Preallocated results of size runs: one record per run, with a float64 field per metric, as the store chunks"""
+    return np.empty(size, dtype=[(metric, np.float64) for metric in metrics])
+
+
+def write_results(buffer, start, res):
+    """Write the per-metric results of the chunk of runs starting at index start into the results buffer"""
+    for metric, values in res.items():
+        buffer[metric][start:start + len(values)] = values
+
+
+def to_buffer(res):
+    """Results buffer holding the given per-metric samples, e.g. of a steady-state simulation"""
+    buffer = results_buffer(res, len(next(iter(res.values()))))
+    write_results(buffer, 0, res)
+    return buffer
+
+
+def columns(res):
+    """
+    Per-metric samples of the results of run_simulations: zero-copy views of the fields of a results buffer, or the
+    per-metric accumulators of a streaming simulation as they are
+    """
+    if isinstance(res, np.ndarray):
+        return {metric: res[metric] for metric in res.dtype.names}
+    return res
+
+
+def update_summaries(summaries, res, seed, sample_size):
+    """Feed the results of a chunk into the per-metric streaming accumulators, creating them at the first chunk"""
+    if summaries is None:
+        summaries = {metric: stats.StreamingSummary(sample_size=sample_size, seed=seed) for metric in res}
+    for metric, values in res.items():
+        summaries[metric].update_many(values)
+    return summaries
+
+
+def run_chunks(run_replications, num_stations, cfg, chunks, starts, logger, pool=None):
+    """
+    Return an iterator over the results of the given chunks, run in the pool if any, in the chunks' order. starts are
+    the indexes of the first replication of each chunk
+    """
+    if pool is not None and profiling.enabled and not cfg.distributed:
+        # Worker processes send back their timers and counters along with the results
+        outputs = pool.map(functools.partial(profiling.run_profiled, run_replications),
+                           repeat(num_stations), repeat(cfg), chunks, repeat(logger), starts)
+        return (profiling.merged(output) for output in outputs)
+    if pool is not None:
+        return pool.map(run_replications, repeat(num_stations), repeat(cfg), chunks, repeat(logger), starts)
+    return (profiling.timed('runner.chunk', run_replications, num_stations, cfg, chunk, logger, start)
+            for chunk, start in zip(chunks, starts))
+
+
+def run_common_replication(sim_, protocol, num_stations, cfg, seed, logger, tracer=None):
+    """
+    Run the replication with the given seed drawing from the common random numbers streams of rng.station_streams,
+    the same for every protocol and number of stations. In antithetic mode the replication is run a second time on
+    the mirrored draws and the average of the pair is returned, whose variance is lower than that of two
+    independent replications. Only the first run of the pair is traced.
+    """
+    outputs = []
+    for antithetic in ((False, True) if cfg.variance_reduction == 'antithetic' else (False,)):
+        streams = rng.station_streams(seed, num_stations, antithetic)
+        packet_probs = [s.param_uniform(*cfg.packet_prob_ranges[protocol]) for s in streams]
+        packet_sizes = [s.param_int(*cfg.packet_size_range) for s in streams]
+        outputs.append(sim_(num_stations, cfg, packet_probs, packet_sizes, streams, logger,
+                            None if antithetic else tracer))
+
+    if len(outputs) == 1:
+        return outputs[0]
+    return tuple((x + y) / 2 for x, y in zip(*outputs))
+
+
+def relative_half_width(values):
+    """Half-width of the confidence interval of the mean, relative to the mean itself"""
+    if isinstance(values, stats.StreamingSummary):
+        if not values.running.m2:
+            return 0.0
+        lower, upper = values.confidence_interval()
+        mean = values.mean()
+    else:
+        if not np.ptp(values):
+            return 0.0
+        lower, upper = stats.compute_confidence_interval(values)
+        mean = stats.compute_mean(values)
+
+    return (upper - lower) / 2 / abs(mean) if mean else math.inf
+
+
+def batch_stops(cfg):
+    """
+    Number of runs completed at the end of each batch: a single batch of NumRuns runs or, in sequential mode,
+    a first batch of NumRuns runs followed by batches of SequentialBatch runs up to MaxRuns
+    """
+    if not cfg.sequential:
+        return [cfg.num_runs]
+    return list(range(min(cfg.num_runs, cfg.max_runs), cfg.max_runs, cfg.sequential_batch)) + [cfg.max_runs]
+
+
+def run_simulations(protocol, run_replications, num_stations, cfg, logger):
+    """
+    Run cfg.num_runs replications of the given protocol, split into chunks of cfg.chunk_size replications.
+    Chunks are spread over cfg.workers processes when more than one worker is configured, each replication
+    drawing from its own RNG stream: a seeded simulation gives the same results whatever the number of workers.
+    If cfg.distributed is set, chunks are served instead to the workers connected to the distributed.Coordinator.
+    Results are written into a results buffer, preallocated for the maximum number of runs, and the view of its
+    completed runs is returned.
+    If cfg.streaming is set, chunks are fed into stats.StreamingSummary accumulators as soon as they complete and
+    the per-metric accumulators are returned instead of the lists of samples.
+    If cfg.sequential is set, runs go on in batches until the confidence interval of the mean of every metric in
+    cfg.sequential_metrics is narrower than cfg.target_precision, relative to the mean, or cfg.max_runs is reached.
+    """
+    stops = batch_stops(cfg)
+    seeds = rng.replication_seeds(rng.parse_seed(cfg.seed), stops[-1])
+
+    # The reservoirs of all the metrics share the same seed, so that they keep the same replications
+    sample_seed = int(np.random.SeedSequence(rng.parse_seed(cfg.seed)).generate_state(1)[0])
+    summaries = None
+
+    # Raw results of each chunk are persisted as soon as it completes, completed chunks are not run again
+    store_ = store.RunStore.open(cfg, protocol, num_stations) if cfg.store else None
+
+    results = None
+    done = 0
+    telemetry.running(protocol, num_stations)
+    if cfg.distributed:
+        # Chunks are served to the workers connected to the coordinator, which outlives this simulation
+        pool = distributed.get_coordinator(cfg, logger)
+    else:
+        pool = ProcessPoolExecutor(max_workers=cfg.workers) if cfg.workers > 1 else None
+    try:
+        for stop in stops:
+            chunks = split_chunks(seeds[done:stop], cfg.chunk_size)
+            starts = [done + i * cfg.chunk_size for i in range(len(chunks))]
+
+            stored = [store_ is not None and store_.has(start, start + len(chunk))
+                      for start, chunk in zip(starts, chunks)]
+            if any(stored):
+                resumed = sum(len(c) for c, is_stored in zip(chunks, stored) if is_stored)
+                logger.info("[%s] :: Resuming %d runs from %s" % (protocol.upper(), resumed, store_.path))
+            outputs = run_chunks(run_replications, num_stations, cfg,
+                                 [c for c, is_stored in zip(chunks, stored) if not is_stored],
+                                 [s for s, is_stored in zip(starts, stored) if not is_stored], logger, pool)
+
+            for start, chunk, is_stored in zip(starts, chunks, stored):
+                if is_stored:
+                    with profiling.timer('runner.store_load'):
+                        res = store_.load(start, start + len(chunk))
+                else:
+                    res = next(outputs)
+                    if store_ is not None:
+                        with profiling.timer('runner.store_save'):
+                            store_.save(start, chunk, res)
+
+                with profiling.timer('runner.merge'):
+                    if cfg.streaming:
+                        summaries = update_summaries(summaries, res, sample_seed, cfg.streaming_sample_size)
+                    else:
+                        if results is None:
+                            results = results_buffer(res, stops[-1])
+                        write_results(results, done, res)
+                done += len(chunk)
+                logger.debug("[%s] :: Run number %d" % (protocol.upper(), done))
+                telemetry.advance(len(chunk), len(chunk) * cfg.num_epochs)
+
+            if cfg.sequential:
+                current = summaries if cfg.streaming else columns(results[:done])
+                precision = max(relative_half_width(current[m]) for m in cfg.sequential_metrics if m in current)
+                logger.info("[%s] :: %d runs, relative CI half-width %.4f (target %.4f)"
+                            % (protocol.upper(), done, precision, cfg.target_precision))
+                if precision <= cfg.target_precision:
+                    break
+    finally:
+        if pool is not None and not cfg.distributed:
+            pool.shutdown()
+
+    if cfg.streaming:
+        return summaries
+
+    return results[:done]
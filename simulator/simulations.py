@@ -1,3 +1,5 @@
+import time
+
 import numpy as np
 
 import stats
@@ -5,127 +7,294 @@ import utils
 import aloha
 import csma
 import config
+import profiling
+import rng
+import runner
+import steady
+import telemetry
+
+# Columns of the bootstrap confidence intervals in the stats tables, see stats.bootstrap_ci
+BOOTSTRAP_COLUMNS = ('CIb median', 'CIb gini', 'CIb CoV', 'CIb gap')
+
+# Inequality statistics, and their confidence intervals, only meaningful for non-negative samples
+INEQUALITY_COLUMNS = ('gini', 'CIb gini', 'CoV', 'CIb CoV', 'gap', 'CIb gap')
 
+# Protocol name -> module running its simulations
+PROTOCOLS = {'aloha': aloha, 'csma': csma}
 
-def compute_stats(df, log_, protocol, num_stations, obs):
+
+def compute_stats(df, log_, protocol, num_stations, obs, k=None, differences=False):
+    """
+    Stats row for the given sample. k holds the statistics as computed by stats.compute_stats_batch, which is
+    called on the sample when they are not given.
+    If differences is set the sample holds signed paired differences, see paired_differences: the inequality
+    statistics are left out of the row.
+    """
+    if k is None:
+        k = stats.compute_stats_batch([df])[0]
 
     s = {
         'protocol': protocol
         , 'num_stations': num_stations
         , 'obs': obs
-        , 'percentiles': " - ".join([str("{:.6f}".format(x)) for x in stats.compute_percentiles(df, np.array([2.5, 25, 75, 97.5]))])
-        , 'mean': stats.compute_mean(df)
-        , 'median': stats.compute_median(df)
-        , 'var': stats.compute_variance(df)
-        , 'std': stats.compute_std(df)
-        , 'ci': " - ".join(str("{:.6f}".format(x)) for x in stats.compute_confidence_interval(df))
-        , 'CIs median': " - ".join(str("{:.6f}".format(x)) for x in stats.compute_ci_median(df))
-        , 'gini': stats.compute_gini_coefficient(df)
-        , 'CoV': stats.compute_coefficient_of_variation(df)
-        , 'mad': stats.compute_mad(df)
-        , 'gap': stats.compute_lorenz_curve_gap(df)
+        , 'runs': len(df)
+        , 'percentiles': " - ".join([str("{:.6f}".format(x)) for x in k['percentiles']])
+        , 'mean': k['mean']
+        , 'median': k['median']
+        , 'var': k['var']
+        , 'std': k['std']
+        , 'ci': " - ".join(str("{:.6f}".format(x)) for x in k['ci'])
+        , 'CIs median': " - ".join(str("{:.6f}".format(x)) for x in k['CIs median'])
+        , 'gini': k['gini']
+        , 'CoV': k['CoV']
+        , 'mad': k['mad']
+        , 'gap': k['gap']
     }
 
+    # Bootstrap confidence intervals, if computed by stats.compute_stats_batch
+    for name in BOOTSTRAP_COLUMNS:
+        if name in k:
+            s[name] = " - ".join(str("{:.6f}".format(x)) for x in k[name])
+
+    if differences:
+        for name in INEQUALITY_COLUMNS:
+            s.pop(name, None)
+
     log_.info("[%s] - [%d stations] :: stats %s" % (protocol.upper(), num_stations, s))
 
     return s
 
 
-def start_simulations(protocols):
+def stats_options(cfg):
+    """Bootstrap options of stats.compute_stats_batch set in the simulation's config"""
+    return {'resamples': cfg.bootstrap_resamples, 'method': cfg.bootstrap_method, 'seed': rng.parse_seed(cfg.seed)}
 
-    # Retrieve the configuration parameters for this simulation
-    cfg = config.Config('./config.ini')
 
-    # Create logger
-    log_ = utils.init_logger(is_debug=cfg.is_debug)
+def compute_streaming_stats(summary, log_, protocol, num_stations, obs):
+    """Same statistics as compute_stats, taken from a stats.StreamingSummary"""
 
-    # Stats for the different simulations' config
-    simulations_res = {ns: {'aloha': {}, 'csma': {}} for ns in cfg.list_num_stations}
-    overall_stats = []
+    s = {
+        'protocol': protocol
+        , 'num_stations': num_stations
+        , 'obs': obs
+        , 'runs': summary.n
+        , 'percentiles': " - ".join([str("{:.6f}".format(x)) for x in summary.percentiles([2.5, 25, 75, 97.5])])
+        , 'mean': summary.mean()
+        , 'median': summary.median()
+        , 'var': summary.variance()
+        , 'std': summary.std()
+        , 'ci': " - ".join(str("{:.6f}".format(x)) for x in summary.confidence_interval())
+        , 'CIs median': " - ".join(str("{:.6f}".format(x)) for x in summary.ci_median())
+        , 'gini': summary.gini()
+        , 'CoV': summary.coefficient_of_variation()
+        , 'mad': summary.mad()
+        , 'gap': summary.lorenz_curve_gap()
+    }
+
+    log_.info("[%s] - [%d stations] :: stats %s" % (protocol.upper(), num_stations, s))
+
+    return s
+
+
+def paired_differences(simulations_res, protocol_a, protocol_b):
+    """
+    Samples of the run by run differences between two protocols, for each number of stations and metric of both.
+    With common random numbers the differences vary much less than the two independent samples do, so their
+    confidence intervals are much tighter for the same number of runs. Differences may be negative, their stats
+    rows are computed with compute_stats(..., differences=True).
+    """
+    pending = []
+    for num_stations, res in simulations_res.items():
+        columns_a, columns_b = runner.columns(res[protocol_a]), runner.columns(res[protocol_b])
+        for metric in columns_a.keys() & columns_b.keys():
+            a, b = columns_a[metric], columns_b[metric]
+            # In sequential mode the protocols may stop after a different number of runs
+            n = min(len(a), len(b))
+            pending.append(('%s-%s' % (protocol_a, protocol_b), num_stations, metric, a[:n] - b[:n]))
+
+    return sorted(pending, key=lambda p: (p[1], p[2]))
+
+
+def run_protocols(protocols, cfg, log_, on_sample=None):
+    """
+    Run the simulations of the given protocols, for every number of stations of the simulation's config, and return
+    the samples waiting for their statistics to be computed by compute_all_stats, as (protocol, num_stations, metric,
+    values) tuples: values are a zero-copy view of the results buffer or, for streaming simulations, a
+    stats.StreamingSummary. The paired differences between ALOHA and CSMA follow, in variance reduction mode.
+    on_sample(protocol, num_stations, metric, values) is called on each sample as soon as it is available, e.g. to
+    plot it while the next simulations run.
+    """
+    # Common random numbers: every protocol and number of stations derive their streams from the same root seed
+    if cfg.variance_reduction != 'none' and rng.parse_seed(cfg.seed) is None:
+        cfg.seed = str(np.random.SeedSequence().entropy)
+        cfg.seed_drawn = True
+
+    # Progress of the runs, the planned ones being NumRuns per simulation even in sequential mode
+    num_simulations = len(protocols) * len(cfg.list_num_stations)
+    if cfg.steady_state:
+        # The batches of each long simulation stand for its runs
+        telemetry.start(cfg, num_simulations * cfg.steady_batches, num_simulations * cfg.steady_epochs, log_)
+    else:
+        telemetry.start(cfg, num_simulations * cfg.num_runs, num_simulations * cfg.num_runs * cfg.num_epochs, log_)
+
+    # Results of the different simulations' config
+    simulations_res = {ns: {} for ns in cfg.list_num_stations}
+    # Samples waiting for their statistics to be computed: (protocol, num_stations, metric, values)
+    pending = []
 
     # Iterate over the different protocols
     for protocol in protocols:
+        if protocol not in PROTOCOLS:
+            log_.error("Protocol %s not supported" % protocol)
+            continue
 
         # Iterate over the different number of devices as specified in the simulation's config
         for num_stations in cfg.list_num_stations:
 
-            data_ = None
-
             # Run simulation with the given parameter and the "ns" number of stations
             # The number of station is the only variable in the simulation
-            if protocol == 'aloha':
-                simulations_res[num_stations][protocol] = aloha.run_simulations(num_stations, cfg, log_)
-            elif protocol == 'csma':
-                simulations_res[num_stations][protocol] = csma.run_simulations(num_stations, cfg, log_)
-            else:
-                log_.error("Protocol %s not supported" % protocol)
-                continue
-
-            # Load results into a DataFrame
-            data_ = utils.load_df(simulations_res[num_stations][protocol])
-
-            for metric, df in simulations_res[num_stations][protocol].items():
-
-                # print(metric, df)
+            start = time.perf_counter()
+            with profiling.timer('simulations.run_simulations'):
+                if cfg.steady_state and protocol in steady.KERNELS:
+                    # Batch means of a single long simulation stand for the runs
+                    res = steady.run_steady_state(protocol, num_stations, cfg, log_)
+                else:
+                    res = PROTOCOLS[protocol].run_simulations(num_stations, cfg, log_)
+            simulations_res[num_stations][protocol] = res
+            log_.info("[%s] :: %d stations simulated in %.3f s" % (protocol.upper(), num_stations,
+                                                                 time.perf_counter() - start))
+
+            # Zero-copy views of the results buffer, one per metric, or the accumulators of streaming simulations
+            for metric, values in runner.columns(res).items():
 
                 # Check if exists any data
-                if df is None:
+                if values is None:
                     log_.error("Can not compute any statistic for protocol %s and %s metric" % (protocol, metric))
                     continue
 
-                log_.debug("Processing metric %s" % metric)
+                pending.append((protocol, num_stations, metric, values))
+                if on_sample is not None:
+                    on_sample(protocol, num_stations, metric, values)
 
-                # Rescale data via Box-Cox transformation
-                try:
-                    t_data = stats.rescale_data(df)
+    telemetry.close()
 
-                    # Create a structure to hold both sampled and rescaled data for a later Boxplot
-                    measures_ = {
-                        'sampled': df,
-                        'rescaled': t_data[0]
-                    }
-                except ValueError:
-                    log_.error("Con not rescale data for protocol %s and %s metric" % (protocol, metric))
+    # Paired differences: the i-th runs of both protocols share the same random numbers
+    if cfg.variance_reduction != 'none' and 'aloha' in protocols and 'csma' in protocols:
+        if cfg.steady_state:
+            log_.error("Can not compute paired differences in steady-state mode, batches are not paired")
+        elif cfg.streaming:
+            log_.error("Can not compute paired differences of streaming simulations, runs are not kept")
+        else:
+            pending += paired_differences(simulations_res, 'aloha', 'csma')
 
-                overall_stats.append(compute_stats(df, log_, protocol, num_stations, metric))
+    return pending
 
-                # Plot graphs
-                # Save plots to file system only if log level is not DEBUG
-                save_fig = not cfg.is_debug
 
-                # Histogram
-                # Number of bins chosen as the square roots of the number of samples
-                n_bins = round(np.sqrt(cfg.num_runs))
-                # Plot histograms for each metric
-                stats.plot_histogram(data_, metric, protocol, num_stations, n_bins, save_fig)
+def compute_all_stats(pending, cfg, log_):
+    """Stats rows of the given (protocol, num_stations, metric, values) samples, as returned by run_protocols"""
 
-                # ECDF
-                title = '%s %s %d stations' % (protocol.upper(), metric, num_stations)
-                fn_ = './plots/%s_%s_%d_ecdf.png' % (protocol, metric, num_stations)
-                stats.plot_ecdf(data_, metric, title=title, fname=fn_, save_fig=save_fig)
+    # Statistics of all the samples at once, each sample being sorted only once
+    with profiling.timer('simulations.stats'):
+        kernel_ = iter(stats.compute_stats_batch([np.asarray(values) for _, _, _, values in pending
+                                                  if not isinstance(values, stats.StreamingSummary)],
+                                                 **stats_options(cfg)))
+        rows = []
+        for protocol, num_stations, metric, values in pending:
+            if isinstance(values, stats.StreamingSummary):
+                rows.append(compute_streaming_stats(values, log_, protocol, num_stations, metric))
+            else:
+                # Paired differences are named after both protocols, e.g. aloha-csma
+                rows.append(compute_stats(np.asarray(values), log_, protocol, num_stations, metric, next(kernel_),
+                                          differences='-' in protocol))
+
+    return rows
 
-                # qqplot
-                title = '%s %s %d stations' % (protocol.upper(), metric, num_stations)
-                fn_ = './plots/%s_%s_%d_qqplot.png' % (protocol, metric, num_stations)
-                stats.plot_qqplot(df, title=title, fname=fn_, save_fig=save_fig)
 
-                # Lorenz Curve
-                title = '%s %s Lorenz Curve for %d stations' % (protocol.upper(), metric, num_stations)
-                fn_ = './plots/%s_%s_%d_lorenz.png' % (protocol, metric, num_stations)
-                # stats.plot_lorenz_curve(data_, title, fname=fn_, save_fig=save_fig)
+def start_simulations(protocols):
+    # matplotlib is only loaded to plot, compute_stats alone does not need it, see headless.py
+    import plotting
 
-                # TODO: chi-squared test the observed sample
+    # Retrieve the configuration parameters for this simulation
+    cfg = config.Config('./config.ini')
 
-                if measures_ is not None:
-                    title = '%s %s median value Box-plot for %d stations' % (protocol.upper(), metric, num_stations)
-                    fn_ = './plots/%s_%s_%d_boxplot.png' % (protocol, metric, num_stations)
-                    stats.plot_boxplot(measures_, title=title, fname=fn_, save_fig=save_fig)
+    # Create logger
+    log_ = utils.init_logger(is_debug=cfg.is_debug)
 
-    # Load overall statistic results into a Panda DataFrame
-    overall_df = utils.load_df(overall_stats)
+    # Per-phase timers and counters, nearly free when disabled
+    profiling.enable(cfg.profile)
+
+    # Save plots to file system only if log level is not DEBUG
+    save_fig = not cfg.is_debug
+    # Plots to be saved are rendered off-screen by background workers, the others are displayed right away
+    plots_ = plotting.PlotPipeline(cfg.plot_workers if save_fig else 0, logger=log_)
+
+    def plot_sample(protocol, num_stations, metric, values):
+        log_.debug("Processing metric %s" % metric)
+
+        # Streaming simulations return accumulators, whose reservoir samples are used for plots
+        # Plot jobs only receive the arrays they need
+        df = np.asarray(values.sample if isinstance(values, stats.StreamingSummary) else values)
+        measures_ = None
+
+        # Rescale data via Box-Cox transformation
+        try:
+            t_data = stats.rescale_data(df)
+
+            # Create a structure to hold both sampled and rescaled data for a later Boxplot
+            measures_ = {
+                'sampled': df,
+                'rescaled': t_data[0]
+            }
+        except ValueError:
+            log_.error("Con not rescale data for protocol %s and %s metric" % (protocol, metric))
+
+        # Plot graphs, rendered in background by the plot pipeline
+
+        # Histogram
+        # Number of bins chosen as the square roots of the number of samples
+        n_bins = round(np.sqrt(len(df)))
+        # Plot histograms for each metric
+        fn_ = './plots/%s_%s_%d_histogram.png' % (protocol, metric, num_stations)
+        plots_.submit(fn_, 'plot_histogram', {metric: df}, metric, protocol, num_stations, n_bins, save_fig)
+
+        # ECDF
+        title = '%s %s %d stations' % (protocol.upper(), metric, num_stations)
+        fn_ = './plots/%s_%s_%d_ecdf.png' % (protocol, metric, num_stations)
+        plots_.submit(fn_, 'plot_ecdf', {metric: df}, metric, title=title, fname=fn_, save_fig=save_fig,
+                      max_error=cfg.plot_max_error)
+
+        # qqplot
+        title = '%s %s %d stations' % (protocol.upper(), metric, num_stations)
+        fn_ = './plots/%s_%s_%d_qqplot.png' % (protocol, metric, num_stations)
+        plots_.submit(fn_, 'plot_qqplot', df, title=title, fname=fn_, save_fig=save_fig)
+
+        # Lorenz Curve
+        title = '%s %s Lorenz Curve for %d stations' % (protocol.upper(), metric, num_stations)
+        fn_ = './plots/%s_%s_%d_lorenz.png' % (protocol, metric, num_stations)
+        plots_.submit(fn_, 'plot_lorenz_curve', df, title, fname=fn_, save_fig=save_fig,
+                      max_error=cfg.plot_max_error)
+
+        # TODO: chi-squared test the observed sample
+
+        if measures_ is not None:
+            title = '%s %s median value Box-plot for %d stations' % (protocol.upper(), metric, num_stations)
+            fn_ = './plots/%s_%s_%d_boxplot.png' % (protocol, metric, num_stations)
+            plots_.submit(fn_, 'plot_boxplot', measures_, title=title, fname=fn_, save_fig=save_fig)
+
+    # Samples are plotted as soon as their simulation completes, statistics are computed once all are available
+    pending = run_protocols(protocols, cfg, log_, plot_sample)
+    overall_stats = compute_all_stats(pending, cfg, log_)
+
+    # Wait for the plots still being rendered
+    with profiling.timer('simulations.plots_wait'):
+        plots_.close()
 
     # Print overall stats in a table-fashioned way
-    utils.print_tables(overall_stats, log_, save_fig)
+    with profiling.timer('simulations.tables'):
+        utils.print_tables(overall_stats, log_, save_fig)
+
+    if cfg.profile:
+        profiling.write_report('./data/%s-profile.dat' % (time.strftime("%Y%m%d-%H%M")), log_)
 
 
 def main():
@@ -1,7 +1,14 @@
-import random
+import bisect
+
+import numpy as np
 
 
 class Station:
+    # Fixed set of attributes: instances carry no __dict__, which saves memory and speeds up attribute access
+    __slots__ = ('id', 'packet_prob', 'packet_size', 'max_backoff_time', 'rng',
+                 'total_packets', 'sent_packets', 'collision', 'lost_packets', 'waiting_time', 'packet_attempt',
+                 'state', 'backoff_time')
+
     # List possible states
     IDLE = 0  # Initial state, station is idle
     TX = 1  # Transmitting
@@ -55,6 +62,11 @@ class Station:
         if not self.backoff_time:
             self.state = Station.RTX
 
+    def end_backoff(self):
+        # The whole backoff time has elapsed at once, see TimerWheel
+        self.backoff_time = 0
+        self.state = Station.RTX
+
     def has_frame_to_transmit(self):
         # If a station is IDLE then it has a frame to be transmitted with
         # probability equals to the one assigned to the node in the init phase
@@ -75,6 +87,7 @@ class Station:
 
 
 class AlohaStation(Station):
+    __slots__ = ()
 
     def __init__(self, id_, packet_prob, packet_size, rng_, max_backoff_time=64):
         super().__init__(id_, packet_prob, packet_size, rng_, max_backoff_time)
@@ -103,6 +116,7 @@ class AlohaStation(Station):
 
 
 class CsmaStation(Station):
+    __slots__ = ()
 
     def __init__(self, id_, packet_prob, packet_size, rng_, max_backoff_time=64):
         super().__init__(id_, packet_prob, packet_size, rng_, max_backoff_time)
@@ -114,3 +128,133 @@ class CsmaStation(Station):
         self.backoff_time = self.rng.generate_random_int(1, self.max_backoff_time)
         self.waiting_time += self.backoff_time
 
+
+class TimerWheel:
+    """
+    Hashed timer wheel of the stations waiting for their backoff time to be over, so that waiting stations cost
+    nothing until their backoff ends, rather than being counted down one by one every epoch.
+    Backoffs only count down in epochs in which the channel is used, so the wheel ticks once per busy epoch. A station
+    starting a backoff of b ticks goes into the bucket (tick + b) mod (max_backoff_time + 1): as no backoff is longer
+    than max_backoff_time, a bucket never holds stations of two different rounds of the wheel.
+    The wheel also keeps the stations not waiting, in index order, which are the only ones to be scanned every epoch.
+    """
+    __slots__ = ('size', 'buckets', 'tick', 'active', 'active_ids')
+
+    def __init__(self, stations, max_backoff_time):
+        self.size = max_backoff_time + 1
+        self.buckets = [[] for _ in range(self.size)]
+        self.tick = 0
+        self.active = list(stations)
+        self.active_ids = [s.id for s in stations]
+
+    def schedule(self, station):
+        """Station entered the WAIT state in the current busy epoch, its backoff starts counting from the next one"""
+        i = bisect.bisect_left(self.active_ids, station.id)
+        del self.active[i]
+        del self.active_ids[i]
+        self.buckets[(self.tick + station.backoff_time) % self.size].append(station)
+
+    def advance(self):
+        """End of a busy epoch: stations whose backoff is over move to RTX, and are returned"""
+        i = self.tick % self.size
+        expired = self.buckets[i]
+        self.buckets[i] = []
+        self.tick += 1
+
+        for s in expired:
+            s.end_backoff()
+            j = bisect.bisect_left(self.active_ids, s.id)
+            self.active.insert(j, s)
+            self.active_ids.insert(j, s.id)
+
+        return expired
+
+
+class StationTable:
+    """
+    Struct-of-arrays counterpart of a list of Station instances: every attribute is a typed array of shape
+    (num_runs, num_stations), each row holding the stations of one replication.
+    Station transitions are table operations applied to the stations selected by a boolean mask.
+    """
+
+    def __init__(self, packet_probs, packet_sizes, max_backoff_time=64):
+        shape = np.shape(packet_probs)
+
+        self.id = np.broadcast_to(np.arange(shape[1], dtype=np.int32), shape)
+        self.packet_prob = np.asarray(packet_probs, dtype=np.float64)
+        self.packet_size = np.asarray(packet_sizes, dtype=np.int8)
+        self.max_backoff_time = max_backoff_time
+
+        # Statistics
+        self.total_packets = np.zeros(shape, dtype=np.int32)
+        self.sent_packets = np.zeros(shape, dtype=np.int32)
+        self.collision = np.zeros(shape, dtype=np.int32)
+        self.lost_packets = np.zeros(shape, dtype=np.int32)
+        self.waiting_time = np.zeros(shape, dtype=np.int64)
+
+        # Initial state is IDLE
+        self.state = np.full(shape, Station.IDLE, dtype=np.int8)
+        self.backoff_time = np.zeros(shape, dtype=np.int32)
+        self.packet_attempt = np.zeros(shape, dtype=np.int32)
+
+    @property
+    def shape(self):
+        return self.state.shape
+
+    def set_idle(self, mask):
+        self.state[mask] = Station.IDLE
+        self.backoff_time[mask] = 0
+        self.packet_attempt[mask] = 0
+
+    def get_ack(self, mask):
+        self.sent_packets += mask
+        self.set_idle(mask)
+
+    def is_waiting(self):
+        return self.state == Station.WAIT
+
+    def decrease_waiting_time(self, mask):
+        self.backoff_time -= mask
+        self.state[mask & (self.backoff_time == 0)] = Station.RTX
+
+    def has_frame_to_transmit(self, rng_):
+        # rng_ is a numpy Generator, one uniform is drawn for each station
+        return (self.state == Station.RTX) | (
+                (self.state == Station.IDLE) & (rng_.random(self.shape) < self.packet_prob))
+
+    def start_tx(self, mask):
+        self.total_packets += mask
+        self.packet_attempt += mask
+        self.state[mask] = Station.TX
+
+    def handle_collision(self, mask, rng_):
+        """ALOHA transition, see AlohaStation.handle_collision"""
+        idx = np.nonzero(mask)
+        if not idx[0].size:
+            return
+
+        self.collision[idx] += 1
+        # Random exponential backoff time, drawn at once for all the colliding stations
+        attempts = self.packet_attempt[idx]
+        backoff_time = rng_.integers(0, np.left_shift(1, np.minimum(attempts, 62).astype(np.int64)))
+
+        is_rtx = backoff_time == 0
+        is_lost = backoff_time > self.max_backoff_time
+        is_wait = ~(is_rtx | is_lost)
+
+        self.state[idx] = np.where(is_rtx, Station.RTX, np.where(is_lost, Station.IDLE, Station.WAIT))
+        self.backoff_time[idx] = np.where(is_wait, backoff_time, 0)
+        self.packet_attempt[idx] = np.where(is_lost, 0, attempts)
+        self.lost_packets[idx] += is_lost
+        self.waiting_time[idx] += np.where(is_wait, backoff_time, 0)
+
+    def wait(self, mask, rng_):
+        """CSMA transition, see CsmaStation.wait"""
+        n = np.count_nonzero(mask)
+        if not n:
+            return
+
+        self.state[mask] = Station.WAIT
+        backoff_time = rng_.integers(1, self.max_backoff_time, n, endpoint=True)
+        self.backoff_time[mask] = backoff_time
+        self.waiting_time[mask] += backoff_time
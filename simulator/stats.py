@@ -1,11 +1,12 @@
 import math
 
 import numpy as np
-import scipy.stats
-import seaborn as sns
-from matplotlib import pyplot as plt
-from scipy import stats as st
-import pandas as pd
+
+import profiling
+
+# SciPy, matplotlib, seaborn and pandas are imported by the functions using them rather than here: the simulation
+# core, e.g. a headless run or a worker process, only needs the numerical functions of this module and starts without
+# loading the plotting and fitting stack
 
 
 def compute_percentiles(data, percentiles):
@@ -55,6 +56,7 @@ def compute_median(data):
 
 def compute_confidence_interval(data, confidence=0.95):
     """Compute given confidence interval."""
+    from scipy import stats as st
     mean = np.mean(data)
     sem = st.sem(data)
     interval = st.t.interval(confidence, len(data) - 1, loc=mean, scale=sem)
@@ -78,14 +80,11 @@ def compute_ci_median(data):
 
 def compute_gini_coefficient(data):
     """Compute Gini coefficient of array of values"""
-    data = np.double(data)
-    data = data / sum(data)
-    # Mean absolute difference
-    mad = np.abs(np.subtract.outer(data, data)).mean()
-    # Relative mean absolute difference
-    rmad = mad / np.mean(data)
-    # Gini coefficient
-    g = 0.5 * rmad
+    # Sorted-rank formula of half the relative mean absolute difference, in place of the n x n differences matrix:
+    # sum_ij |x_i - x_j| = 2 * sum_i (2i - n - 1) * x_(i), x_(i) being the i-th smallest value
+    sdata = np.sort(np.double(data))
+    n = sdata.size
+    g = np.sum((2 * np.arange(1, n + 1) - n - 1) * sdata) / (n * np.sum(sdata))
     return g
 
 
@@ -98,7 +97,7 @@ def compute_mad(data):
     """Mean Absolute Deviation"""
     m = compute_mean(data)
     n = len(data)
-    mad = sum(abs(data - m)) / n
+    mad = np.sum(np.abs(np.asarray(data) - m)) / n
 
     return mad
 
@@ -114,56 +113,308 @@ def compute_lorenz_curve_gap(data):
     return gap
 
 
+def compute_sorted_stats(sdata, percentiles=(2.5, 25, 75, 97.5), confidence=0.95):
+    """
+    Statistics of compute_stats for a batch of samples of the same size, sdata being a (num_samples, n) array
+    with each row sorted. Everything comes from the sorted rows and their cumulative sums, no further sorting.
+    Returns a dict of arrays with one value per sample.
+    """
+    from scipy import stats as st
+    m, n = sdata.shape
+    csum = np.cumsum(sdata, axis=1)
+    total = csum[:, -1]
+    mean = total / n
+    var = np.var(sdata, axis=1)
+    std = np.sqrt(var)
+    rows = np.arange(m)
+
+    def percentile(p):
+        # Linear interpolation between the closest ranks, as np.percentile
+        h = (n - 1) * p / 100
+        lo = math.floor(h)
+        hi = min(lo + 1, n - 1)
+        return sdata[:, lo] + (h - lo) * (sdata[:, hi] - sdata[:, lo])
+
+    # Confidence interval of the mean, t distribution as compute_confidence_interval
+    sem = np.sqrt(var * n / (n - 1)) / np.sqrt(n) if n > 1 else np.full(m, np.nan)
+    t = st.t.ppf((1 + confidence) / 2, n - 1)
+
+    # Confidence interval of the median from order statistics, as compute_ci_median
+    lower = min(max(math.floor((0.50 * n) - (0.980 * math.sqrt(n))), 0), n - 1)
+    upper = min(math.ceil((0.50 * n) + 1 + (0.980 * math.sqrt(n))), n - 1)
+
+    # Mean absolute deviation: values below the mean contribute mean - x, the others x - mean
+    below = np.sum(sdata < mean[:, None], axis=1)
+    below_sum = np.where(below > 0, csum[rows, np.maximum(below - 1, 0)], 0)
+    mad = (mean * below - below_sum + (total - below_sum) - mean * (n - below)) / n
+
+    # Gini coefficient from the sorted-rank formula, see compute_gini_coefficient
+    gini = np.sum((2 * np.arange(1, n + 1) - n - 1) * sdata, axis=1) / (n * total)
+
+    return {
+        'percentiles': np.stack([percentile(p) for p in percentiles], axis=1)
+        , 'mean': mean
+        , 'median': percentile(50)
+        , 'var': var
+        , 'std': std
+        , 'ci': np.stack([mean - t * sem, mean + t * sem], axis=1)
+        , 'CIs median': np.stack([sdata[:, lower], sdata[:, upper]], axis=1)
+        , 'gini': gini
+        , 'CoV': std / mean
+        , 'mad': mad
+        , 'gap': mad / (2 * mean)
+    }
+
+
+def compute_stats_batch(samples, percentiles=(2.5, 25, 75, 97.5), confidence=0.95, resamples=0, method='bca',
+                        seed=None):
+    """
+    Run compute_sorted_stats over a list of samples: samples of the same size are stacked and sorted at once.
+    If resamples is given, the bootstrap confidence intervals of bootstrap_ci are added as 'CIb <statistic>', the
+    generator being seeded with seed, so that the same samples always get the same intervals.
+    Returns, in the samples' order, a dict of statistics for each sample.
+    """
+    res = [None] * len(samples)
+    sizes = {}
+    for i, sample in enumerate(samples):
+        sizes.setdefault(len(sample), []).append(i)
+
+    rng_ = np.random.default_rng(seed)
+    for n, idx in sizes.items():
+        sdata = np.sort(np.array([np.asarray(samples[i], dtype=np.float64) for i in idx]), axis=1)
+        batch = compute_sorted_stats(sdata, percentiles, confidence)
+        for row, i in enumerate(idx):
+            res[i] = {k: v[row] for k, v in batch.items()}
+            if resamples and n > 1:
+                with profiling.timer('stats.bootstrap'):
+                    cis = bootstrap_ci(sdata[row], resamples, confidence, method, rng_)
+                res[i].update(('CIb ' + name, ci) for name, ci in cis.items())
+
+    return res
+
+
+def compute_weighted_stats(sdata, w):
+    """
+    Median, Gini coefficient, CoV and Lorenz curve gap, as computed by compute_sorted_stats, of a batch of resamples
+    of the sorted sample sdata, the b-th resample holding w[b, j] times the value sdata[j]. Resamples are neither
+    materialised nor sorted: the ranks of every value come from the cumulative sums of the weights.
+    Returns a dict of arrays with one value per resample.
+    """
+    n = len(sdata)
+    m = w.sum(axis=1)
+    c = np.cumsum(w, axis=1)
+
+    total = w @ sdata
+    mean = total / m
+    # Variance of the values shifted by their overall mean, less prone to cancellation
+    shift = sdata - sdata.mean()
+    var = np.maximum(w @ (shift * shift) / m - (mean - sdata.mean()) ** 2, 0)
+
+    # Median, linear interpolation between the closest ranks as np.percentile: the value of 0-based rank k is the
+    # one of the first index whose cumulative weight is greater than k
+    h = (m - 1) * 0.5
+    lo = np.floor(h)
+    x_lo = sdata[np.minimum(np.sum(c <= lo[:, None], axis=1), n - 1)]
+    x_hi = sdata[np.minimum(np.sum(c <= lo[:, None] + 1, axis=1), n - 1)]
+
+    mad = np.sum(w * np.abs(sdata - mean[:, None]), axis=1) / m
+
+    # Sorted-rank formula of compute_gini_coefficient: the w[b, j] copies of sdata[j] take the ranks from
+    # c[b, j] - w[b, j] + 1 to c[b, j], whose sum of 2i - m - 1 is w[b, j] * (2 * c[b, j] - w[b, j] - m)
+    gini = np.sum(w * (2 * c - w - m[:, None]) * sdata, axis=1) / (m * total)
+
+    return {
+        'median': x_lo + (h - lo) * (x_hi - x_lo)
+        , 'gini': gini
+        , 'CoV': np.sqrt(var) / mean
+        , 'gap': mad / (2 * mean)
+    }
+
+
+def weighted_stats_chunks(sdata, weights):
+    """compute_weighted_stats over the weight matrices yielded by weights, one chunk of rows at a time"""
+    chunks = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for w in weights:
+            for name, values in compute_weighted_stats(sdata, w).items():
+                chunks.setdefault(name, []).append(values)
+    return {name: np.concatenate(values) for name, values in chunks.items()}
+
+
+def bootstrap_ci(sdata, resamples=2000, confidence=0.95, method='bca', rng_=None, chunk_elements=2 ** 20,
+                 jackknife_groups=1000):
+    """
+    Bootstrap confidence intervals of the median, Gini coefficient, CoV and Lorenz curve gap of the sorted sample
+    sdata. The resamples are drawn as one matrix of indices, chunk by chunk so that no array holds more than
+    chunk_elements values, and turned into per-value counts for compute_weighted_stats.
+    method is either percentile or bca (bias-corrected and accelerated): the acceleration comes from the jackknife,
+    leave-one-out up to jackknife_groups values, or deleting one of jackknife_groups random groups beyond.
+    Returns a dict of (lower, upper) intervals.
+    """
+    if method not in ('percentile', 'bca'):
+        raise ValueError("Bootstrap method %s not supported" % method)
+
+    sdata = np.asarray(sdata, dtype=np.float64)
+    n = len(sdata)
+    rng_ = np.random.default_rng() if rng_ is None else rng_
+    rows = max(1, chunk_elements // n)
+
+    def resample_weights():
+        for start in range(0, resamples, rows):
+            b = min(rows, resamples - start)
+            # Indices of the b resamples, offset by row so that a single bincount counts the draws of every row
+            idx = rng_.integers(0, n, (b, n)) + np.arange(b)[:, None] * n
+            yield np.bincount(idx.ravel(), minlength=b * n).reshape(b, n).astype(np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        theta = compute_weighted_stats(sdata, np.ones((1, n)))
+    boot = weighted_stats_chunks(sdata, resample_weights())
+
+    alpha = (1 - confidence) / 2
+    if method == 'percentile':
+        levels = {name: (alpha, 1 - alpha) for name in boot}
+    else:
+        groups = rng_.permutation(n) % jackknife_groups if n > jackknife_groups else np.arange(n)
+        num_groups = min(n, jackknife_groups)
+
+        def jackknife_weights():
+            for start in range(0, num_groups, rows):
+                ids = np.arange(start, min(start + rows, num_groups))
+                yield (groups != ids[:, None]).astype(np.float64)
+
+        jack = weighted_stats_chunks(sdata, jackknife_weights())
+        levels = {name: bca_levels(boot[name], theta[name][0], jack[name], alpha) for name in boot}
+
+    res = {}
+    for name, values in boot.items():
+        values = values[np.isfinite(values)]
+        res[name] = tuple(float(q) for q in np.quantile(values, levels[name])) if values.size else (np.nan, np.nan)
+
+    return res
+
+
+def bca_levels(boot, theta, jack, alpha):
+    """Quantile levels of the BCa interval, given the bootstrap and jackknife values of a statistic"""
+    from statistics import NormalDist
+    normal = NormalDist()
+
+    boot = boot[np.isfinite(boot)]
+    jack = jack[np.isfinite(jack)]
+    if not boot.size or not np.isfinite(theta) or not np.ptp(boot):
+        return alpha, 1 - alpha
+
+    # Bias correction: share of the resamples below the estimate, ties counted half, as common for medians
+    p = (np.sum(boot < theta) + 0.5 * np.sum(boot == theta)) / boot.size
+    p = min(max(p, 0.5 / boot.size), 1 - 0.5 / boot.size)
+    z0 = normal.inv_cdf(p)
+
+    # Acceleration: skewness of the jackknife influence values
+    d = jack.mean() - jack
+    den = 6 * np.sum(d ** 2) ** 1.5
+    a = np.sum(d ** 3) / den if den else 0.0
+
+    levels = []
+    for q in (alpha, 1 - alpha):
+        z = z0 + normal.inv_cdf(q)
+        # Beyond the pole of the adjustment, extreme skewness, the plain percentile level is kept
+        levels.append(normal.cdf(z0 + z / (1 - a * z)) if a * z < 1 else q)
+    return tuple(levels)
+
+
 def rescale_data(data):
     """Apply the Box-Cox transformation to given data. Data is best rescaled"""
-    t_data = scipy.stats.boxcox(data)
+    import scipy.stats
+    with profiling.timer('stats.boxcox'):
+        t_data = scipy.stats.boxcox(data)
 
     return t_data
 
 
+def save_figure(fname):
+    """Save the current figure as a PNG file"""
+    from matplotlib import pyplot as plt
+    with profiling.timer('plot.savefig'):
+        plt.savefig(fname, bbox_inches='tight')
+
+
 def plot_histogram(data_, metric, protocol, num_stations, bins=20, save_fig=False):
     # Throughput histogram
+    import seaborn as sns
+    from matplotlib import pyplot as plt
     title = '%s %s %d stations' % (protocol.upper(), metric, num_stations)
     # Seaborn
     sns.histplot(data=data_, x=metric, bins=bins, kde=True).set_title(title)
 
     if save_fig:
         fn_ = './plots/%s_%s_%d_histogram.png' % (protocol, metric, num_stations)
-        plt.savefig(fn_, bbox_inches='tight')
+        save_figure(fn_)
 
     plt.show()
 
 
-def plot_lorenz_curve(data_, title, fname, save_fig=False):
-    """The curve is a graph showing the proportion of overall income or wealth
-    assumed by the bottom x % of the people"""
-    sns.set()
+def lorenz_curve(data):
+    """
+    Lorenz curve of the given sample: cumulative share of the total held by the bottom x share of the values.
+    Returns the n + 1 points of the curve, starting from (0, 0), from the cumulative sums of the sorted sample.
+    """
+    sdata = np.sort(np.asarray(data, dtype=np.float64))
+    n = sdata.size
+    x = np.arange(n + 1) / n
+    y = np.concatenate([[0.0], np.cumsum(sdata)]) / np.sum(sdata)
+
+    return x, y
+
+
+def downsample_curve(x, y, max_error):
+    """
+    Keep the points of a non-decreasing curve (Lorenz curve, ECDF) needed to draw it, joining the kept points
+    by straight lines, with a vertical error not above max_error: the first point of each max_error wide band of
+    y values and the point right before it are kept, so that between two kept points y moves less than max_error.
+    About 2 / max_error points are kept, whatever the sample size.
+    Returns the kept points and the maximum vertical error actually made over all the points of the curve.
+    """
+    n = len(y)
+    if n <= 2 or not max_error:
+        return x, y, 0.0
 
-    m = compute_mean(data_)
-    sdata = np.sort(data_)
-    n = len(data_)
+    band = np.floor((y - y[0]) / max_error)
+    first = np.flatnonzero(np.diff(band)) + 1
+    keep = np.unique(np.concatenate([[0, n - 1], first, first - 1]))
 
-    z = n * m
+    # Vertical distance of each point of the curve from the polyline through the kept ones
+    err = float(np.max(np.abs(np.interp(x, x[keep], y[keep]) - y)))
 
-    lorenz_curve = np.sort([(sum(sdata[:i + 1]) / n * m) for i, d in enumerate(sdata)])
-    # lorenz_curve = sdata.cumsum() / z
+    return x[keep], y[keep], err
+
+
+def plot_lorenz_curve(data_, title, fname, save_fig=False, max_error=None):
+    """The curve is a graph showing the proportion of overall income or wealth
+    assumed by the bottom x % of the people. If max_error is given the curve is downsampled with
+    downsample_curve; the maximum vertical error is returned"""
+    import seaborn as sns
+    from matplotlib import pyplot as plt
+    sns.set()
+
+    x, lorenz_curve_, err = downsample_curve(*lorenz_curve(data_), max_error)
 
     fig, ax = plt.subplots(figsize=[6, 6])
-    ## scatter plot of Lorenz curve
-    ax.scatter(np.arange(lorenz_curve.size) / (lorenz_curve.size - 1), lorenz_curve,
-               marker='x', color='darkgreen', s=100)
+    ## line plot of Lorenz curve, markers only make sense for a few points
+    ax.plot(x, lorenz_curve_, marker='x' if x.size <= 100 else None, color='darkgreen')
     ## line plot of equality
     ax.plot([0, 1], [0, 1], color='k')
 
     plt.title(title)
 
     if save_fig:
-        plt.savefig(fname, bbox_inches='tight')
+        save_figure(fname)
 
     plt.show()
 
+    return err
+
 
 def plot_scatterplot(data_, x, y, save_fig=False):
+    import seaborn as sns
     sns.set_theme(style="white", color_codes=True)
 
     # Use JointGrid directly to draw a custom plot
@@ -174,6 +425,7 @@ def plot_scatterplot(data_, x, y, save_fig=False):
 
 
 def plot_catplot(data_, protocol, save_fig=False):
+    import seaborn as sns
     sns.set()
     # Draw a pointplot to show pulse as a function of three categorical factors
     g = sns.catplot(
@@ -185,6 +437,9 @@ def plot_catplot(data_, protocol, save_fig=False):
 
 
 def plot_qqplot(data, title, fname=None, save_fig=False):
+    import seaborn as sns
+    from matplotlib import pyplot as plt
+    import scipy.stats
     sns.set()
 
     x = np.array(data)
@@ -194,7 +449,8 @@ def plot_qqplot(data, title, fname=None, save_fig=False):
     # Test for geometric distribution
     # TODO: check for others
     # TODO: chi-square test
-    res = scipy.stats.fit(dist, data)
+    with profiling.timer('plot.qqplot_fit'):
+        res = scipy.stats.fit(dist, data)
     # print(res)
     # Set ditribution params
     params = res.params if res.success else (0.02)  # 0.02 default value after observation
@@ -223,12 +479,15 @@ def plot_qqplot(data, title, fname=None, save_fig=False):
     # plot.qqplot(line='45')
 
     if save_fig:
-        plt.savefig(fname, bbox_inches='tight')
+        save_figure(fname)
 
     plt.show()
 
 
 def plot_boxplot(data, title="Boxplot", fname=None, save_fig=False):
+    import seaborn as sns
+    from matplotlib import pyplot as plt
+    import pandas as pd
     sns.set()
 
     df = pd.DataFrame(data, columns=['sampled', 'rescaled'])
@@ -243,16 +502,24 @@ def plot_boxplot(data, title="Boxplot", fname=None, save_fig=False):
     plt.title(title)
 
     if save_fig:
-        plt.savefig(fname, bbox_inches='tight')
+        save_figure(fname)
     plt.show()
 
 
-def plot_ecdf(data_, metric, title='ECDF', fname=None, save_fig=False):
+def plot_ecdf(data_, metric, title='ECDF', fname=None, save_fig=False, max_error=None):
+    """Plot the ECDF of the given metric. If max_error is given the ECDF is downsampled with downsample_curve and
+    drawn as a line; the maximum vertical error is returned"""
+    import seaborn as sns
+    from matplotlib import pyplot as plt
     sns.set_theme()
 
     x, y = ecdf(data_[metric])
+    x, y, err = downsample_curve(x, y, max_error)
 
-    _ = plt.plot(x, y, marker='.', linestyle='none')
+    if max_error:
+        _ = plt.plot(x, y, marker=None, linestyle='-')
+    else:
+        _ = plt.plot(x, y, marker='.', linestyle='none')
     _ = plt.xlabel(metric)
     _ = plt.ylabel("ECDF")
     plt.title(title)
@@ -261,9 +528,11 @@ def plot_ecdf(data_, metric, title='ECDF', fname=None, save_fig=False):
     plt.margins(0.02)
 
     if save_fig:
-        plt.savefig(fname, bbox_inches='tight')
+        save_figure(fname)
     plt.show()
 
+    return err
+
 
 def ecdf(data):
     """Compute ECDF for a one-dimensional array of measurements."""
@@ -277,3 +546,263 @@ def ecdf(data):
     y = np.arange(1, n + 1) / n
 
     return x, y
+
+
+class RunningStats:
+    """
+    Online mean and variance (Welford's algorithm), minimum and maximum of a stream of observations.
+    Two instances can be merged, e.g. when accumulated by different workers (Chan et al. update).
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def update_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not values.size:
+            return
+        batch = RunningStats()
+        batch.n = values.size
+        batch.mean = float(np.mean(values))
+        batch.m2 = float(np.sum((values - batch.mean) ** 2))
+        batch.min = float(np.min(values))
+        batch.max = float(np.max(values))
+        self.merge(batch)
+
+    def merge(self, other):
+        n = self.n + other.n
+        if not n:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        """Population variance, as np.var"""
+        return self.m2 / self.n if self.n else np.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self.n else np.nan
+
+
+class P2Quantile:
+    """
+    Streaming estimate of a single quantile by the P-square algorithm (Jain and Chlamtac, 1985):
+    five markers are kept and adjusted at each observation, memory is constant.
+    """
+
+    def __init__(self, q):
+        # Quantile as a fraction in [0, 1]
+        self.q = q
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * q, 4 * q, 2 + 2 * q, 4]
+        self.increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def update(self, x):
+        h = self.heights
+        if len(h) < 5:
+            h.append(x)
+            h.sort()
+            return
+
+        # Find the cell k the observation falls in, extending the extreme markers if needed
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= h[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Adjust the heights of the three middle markers
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # Piecewise parabolic prediction, linear one if it would break the markers' order
+                hp = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+                        (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+                if not h[i - 1] < hp < h[i + 1]:
+                    hp = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                h[i] = hp
+                n[i] += d
+
+    def value(self):
+        if not self.heights:
+            return np.nan
+        if len(self.heights) < 5:
+            return float(np.percentile(self.heights, self.q * 100))
+        return self.heights[2]
+
+
+class ReservoirSample:
+    """
+    Uniform random sample of fixed size of a stream of observations (Algorithm R), mergeable.
+    It is the summary used to approximate the statistics which can not be computed online, such as MAD and Gini.
+    Reservoirs sharing the same seed and fed the same number of observations keep the same positions, so the
+    reservoirs of the different metrics of a simulation hold the same replications.
+    """
+
+    def __init__(self, size=10000, seed=None):
+        self.size = size
+        self.n = 0
+        self.sample = np.empty(0)
+        self.rng = np.random.default_rng(seed)
+
+    def update_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+
+        # Fill the reservoir first
+        free = min(self.size - self.sample.size, values.size)
+        if free > 0:
+            self.sample = np.concatenate([self.sample, values[:free]])
+            self.n += free
+            values = values[free:]
+        if not values.size:
+            return
+
+        # The t-th observation replaces a random slot with probability size / t
+        t = self.n + np.arange(1, values.size + 1)
+        slots = np.floor(self.rng.random(values.size) * t).astype(np.int64)
+        accepted = slots < self.size
+        slots, values = slots[accepted], values[accepted]
+        # Later observations overwrite earlier ones sharing the same slot
+        last = slots.size - 1 - np.unique(slots[::-1], return_index=True)[1]
+        self.sample[slots[last]] = values[last]
+        self.n += t.size
+
+    def update(self, x):
+        self.update_many([x])
+
+    def merge(self, other):
+        n = self.n + other.n
+        k = min(self.size, n)
+        if not other.n:
+            return self
+        # Number of observations to keep from this reservoir, the others come from the other one
+        from_self = self.rng.hypergeometric(self.n, other.n, k) if self.n else 0
+        self.sample = np.concatenate([
+            self.rng.choice(self.sample, from_self, replace=False),
+            self.rng.choice(other.sample, k - from_self, replace=False)])
+        self.n = n
+        return self
+
+
+class StreamingSummary:
+    """
+    Accumulates, in constant memory, the statistics compute_stats reports for a metric: exact mean, variance,
+    minimum and maximum, P-square estimates of the percentiles and a reservoir sample for MAD, Gini and the
+    median confidence interval. Summaries can be merged: percentiles are then taken from the merged reservoir,
+    P-square markers not being mergeable.
+    """
+
+    def __init__(self, percentiles=(2.5, 25, 50, 75, 97.5), sample_size=10000, seed=None):
+        self.running = RunningStats()
+        self.quantiles = {p: P2Quantile(p / 100) for p in percentiles}
+        self.reservoir = ReservoirSample(sample_size, seed)
+        self.merged = False
+
+    def update_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.running.update_many(values)
+        for q in self.quantiles.values():
+            for x in values.tolist():
+                q.update(x)
+        self.reservoir.update_many(values)
+
+    def update(self, x):
+        self.update_many([x])
+
+    def merge(self, other):
+        self.running.merge(other.running)
+        self.reservoir.merge(other.reservoir)
+        self.merged = True
+        return self
+
+    @property
+    def n(self):
+        return self.running.n
+
+    @property
+    def sample(self):
+        return self.reservoir.sample
+
+    def percentiles(self, percentiles):
+        if self.merged or any(p not in self.quantiles for p in percentiles):
+            return compute_percentiles(self.sample, np.array(percentiles))
+        return np.array([self.quantiles[p].value() for p in percentiles])
+
+    def mean(self):
+        return self.running.mean
+
+    def median(self):
+        return self.percentiles([50])[0]
+
+    def variance(self):
+        return self.running.variance
+
+    def std(self):
+        return self.running.std
+
+    def confidence_interval(self, confidence=0.95):
+        """t confidence interval of the mean, as compute_confidence_interval"""
+        from scipy import stats as st
+        n = self.running.n
+        sem = math.sqrt(self.running.m2 / (n - 1)) / math.sqrt(n)
+        return st.t.interval(confidence, n - 1, loc=self.running.mean, scale=sem)
+
+    def ci_median(self):
+        """
+        Order statistics of compute_ci_median, located on the reservoir sample. Their ranks are those of the
+        reservoir's size, not of the number of values seen: the interval can not be tighter than the sample it is
+        read from.
+        """
+        n = len(self.sample)
+        lower = math.floor((0.50 * n) - (0.980 * math.sqrt(n))) / n
+        upper = math.ceil((0.50 * n) + 1 + (0.980 * math.sqrt(n))) / n
+        return list(np.quantile(self.sample, [max(lower, 0), min(upper, 1)]))
+
+    def mad(self):
+        """Mean absolute deviation from the exact mean, averaged over the reservoir sample"""
+        return float(np.mean(np.abs(self.sample - self.running.mean)))
+
+    def gini(self):
+        """Gini coefficient of the reservoir sample, from the sorted-rank formula"""
+        x = np.sort(self.sample)
+        n = x.size
+        return float(np.sum((2 * np.arange(1, n + 1) - n - 1) * x) / (n * np.sum(x)))
+
+    def coefficient_of_variation(self):
+        return self.running.std / self.running.mean
+
+    def lorenz_curve_gap(self):
+        return self.mad() / (2 * self.running.mean)
@@ -0,0 +1,129 @@
+import copy
+
+import numpy as np
+
+import events
+import rng
+import runner
+import telemetry
+
+# Per-window metrics of each protocol, computed from the differences of the cumulative counters recorded by the
+# event driven kernels: (transmission size, transmissions, collisions, waiting time, lost packets) for ALOHA and
+# (transmission size, packets, waiting time) for CSMA
+KERNELS = {'aloha': events.sim_aloha_events, 'csma': events.sim_csma_events}
+
+
+def window_metrics(protocol, d, num_stations, epochs, num_epochs):
+    """
+    Metrics of the given sums of counter differences d, spanning the given number of epochs. Metrics which are
+    totals over a simulation, e.g. the delay, are scaled to a simulation of num_epochs epochs, so that they compare
+    with the results of independent replications.
+    """
+    scale = num_epochs / epochs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if protocol == 'aloha':
+            return {
+                'throughput': d[..., 0] / epochs
+                , 'collision_rate': d[..., 2] / d[..., 1]
+                , 'delay': d[..., 3] / num_stations * scale
+                , 'lost_packets': d[..., 4] / num_stations * scale
+                , 'tx_packets': d[..., 1] * scale
+            }
+        return {
+            'throughput': d[..., 0] / epochs
+            , 'delay': d[..., 2] / num_stations * scale
+            , 'tx_packets': d[..., 1] * scale
+        }
+
+
+def mser5(x):
+    """
+    Warm-up truncation point of the series x by the MSER-5 rule: the series is averaged in batches of 5
+    observations, then the number d of leading batches minimising the marginal standard error of the mean of the
+    remaining ones, sum((y[d:] - mean(y[d:])) ** 2) / (n - d) ** 2, is dropped. Only truncations up to half the
+    series are considered, beyond that the rule is known to be unreliable.
+    Returns the number of observations of x to be dropped.
+    """
+    n = len(x) // 5
+    if n < 2:
+        return 0
+    y = np.asarray(x[:n * 5], dtype=float).reshape(n, 5).mean(axis=1)
+
+    # Sums and sums of squares of every suffix of y
+    s1 = np.cumsum(y[::-1])[::-1]
+    s2 = np.cumsum((y ** 2)[::-1])[::-1]
+    m = np.arange(n, 0, -1)
+    mse = (s2 - s1 ** 2 / m) / m ** 2
+
+    d = int(np.argmin(mse[:n // 2 + 1]))
+    return d * 5
+
+
+def batch_means(d, num_batches):
+    """Sums of the counter differences d in num_batches consecutive batches, the few trailing windows left over
+    being dropped, along with the number of windows of each batch"""
+    size = len(d) // num_batches
+    return d[:size * num_batches].reshape(num_batches, size, -1).sum(axis=1), size
+
+
+def run_long(protocol, num_stations, cfg, logger):
+    """
+    One simulation of cfg.steady_epochs epochs, run by the event driven kernel, returning the cumulative counters
+    at the end of every window of cfg.steady_window epochs, and whether the simulation stalled.
+    Backoffs only count down in epochs in which the channel is used, so an ALOHA simulation stalls for good once
+    every station waits for its backoff; its series ends there.
+    """
+    seed = rng.replication_seeds(rng.parse_seed(cfg.seed), 1)[0]
+    rng_ = rng.create_generator(seed, cfg.rng_backend)
+
+    packet_probs = [rng_.generate_random_uniform(*cfg.packet_prob_ranges[protocol]) for _ in range(num_stations)]
+    packet_sizes = [rng_.generate_random_int(*cfg.packet_size_range) for _ in range(num_stations)]
+
+    cfg_ = copy.copy(cfg)
+    cfg_.num_epochs = cfg.steady_epochs
+
+    series = []
+    KERNELS[protocol](num_stations, cfg_, packet_probs, packet_sizes, rng_, logger, series=series,
+                      window=cfg.steady_window)
+
+    return np.asarray(series, dtype=float), len(series) < cfg.steady_epochs // cfg.steady_window
+
+
+def run_steady_state(protocol, num_stations, cfg, logger):
+    """
+    Steady-state estimates of the given protocol from a single long simulation: the warm-up is truncated by MSER-5,
+    the longest one among the metrics, and the remaining windows are grouped into cfg.steady_batches batches.
+    The batch means are returned in a results buffer, as by runner.run_simulations, each batch standing for a run, so
+    that the confidence intervals of the stats tables are batch-means confidence intervals.
+    Every metric is None if the simulation stalled, as ALOHA ones do, or is too short for the batches.
+    """
+    telemetry.running(protocol, num_stations)
+    cum, stalled = run_long(protocol, num_stations, cfg, logger)
+    # Batches are all completed at once, the simulation having gone through its epochs, or stalled
+    telemetry.advance(cfg.steady_batches, cfg.steady_epochs)
+    # No metric at all, the stats tables report it as such
+    none_ = {metric: None for metric in window_metrics(protocol, np.zeros((1, 5)), num_stations, 1, 1)}
+
+    # A stalled simulation has no steady state: its windows only cover the transient up to the stall
+    if stalled:
+        logger.error("[%s] :: %d stations stalled after %d epochs, every station waiting for its backoff, no "
+                     "steady-state estimate" % (protocol.upper(), num_stations, len(cum) * cfg.steady_window))
+        return none_
+
+    if len(cum) < 2 * cfg.steady_batches:
+        logger.error("[%s] :: %d stations, %d windows are not enough for %d batches" %
+                     (protocol.upper(), num_stations, len(cum), cfg.steady_batches))
+        return none_
+
+    # Counter differences of every window
+    d = np.diff(cum, axis=0, prepend=np.zeros((1, cum.shape[1])))
+
+    windows = window_metrics(protocol, d, num_stations, cfg.steady_window, cfg.num_epochs)
+    warmup = max(mser5(np.nan_to_num(x)) for x in windows.values())
+
+    batches, size = batch_means(d[warmup:], cfg.steady_batches)
+    logger.info("[%s] :: %d stations, warm-up of %d epochs truncated, %d batches of %d epochs" %
+                (protocol.upper(), num_stations, warmup * cfg.steady_window, cfg.steady_batches,
+                 size * cfg.steady_window))
+
+    return runner.to_buffer(window_metrics(protocol, batches, num_stations, size * cfg.steady_window, cfg.num_epochs))
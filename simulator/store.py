@@ -0,0 +1,98 @@
+import glob
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+import rng
+
+
+def config_key(cfg):
+    """Parameters a replication's results depend on, other than protocol and number of stations"""
+    return {
+        'num_epochs': cfg.num_epochs
+        , 'max_backoff_time': cfg.max_backoff_time
+        , 'seed': rng.parse_seed(cfg.seed)
+        , 'engine': cfg.engine
+        , 'rng_backend': cfg.rng_backend
+        , 'variance_reduction': cfg.variance_reduction
+        , 'chunk_size': cfg.chunk_size
+        , 'packet_prob_ranges': cfg.packet_prob_ranges
+        , 'packet_size_range': cfg.packet_size_range
+    }
+
+
+class RunStore:
+    """
+    Columnar on-disk store of the raw results of the replications of one (protocol, number of stations)
+    simulation. Each chunk of replications is a .npy file holding a structured array, one record per replication:
+    replication index, seed of its RNG stream and one field per metric. Chunks are written atomically as soon as
+    they complete, so that a simulation with the same configuration and seed can resume from the completed ones.
+    Chunks are read back memory mapped.
+    """
+
+    def __init__(self, path, protocol, num_stations, params):
+        self.path = path
+        self.protocol = protocol
+        self.num_stations = num_stations
+        os.makedirs(path, exist_ok=True)
+
+        manifest = os.path.join(path, 'manifest.json')
+        if not os.path.exists(manifest):
+            with open(manifest, 'w') as f:
+                json.dump({'protocol': protocol, 'num_stations': num_stations, 'config': params}, f, indent=1)
+
+    @classmethod
+    def open(cls, cfg, protocol, num_stations):
+        """
+        Store of the given simulation under cfg.store_path. Seeded simulations with the same configuration share
+        the same store and resume from it; unseeded ones can not be resumed and get a new store each time.
+        """
+        params = config_key(cfg)
+        # A root seed drawn at run time does not make a simulation seeded
+        if params['seed'] is None or cfg.seed_drawn:
+            key = 'unseeded-%s-%d' % (time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+        else:
+            key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+        return cls(os.path.join(cfg.store_path, key, '%s_%d' % (protocol, num_stations)),
+                   protocol, num_stations, params)
+
+    def chunk_path(self, start, stop):
+        return os.path.join(self.path, 'chunk_%09d_%09d.npy' % (start, stop))
+
+    def has(self, start, stop):
+        return os.path.exists(self.chunk_path(start, stop))
+
+    def save(self, start, seeds, res):
+        """Append the results of the chunk of replications starting at index start"""
+        records = np.empty(len(seeds), dtype=[('replication', np.int64), ('seed', np.uint64)] +
+                                              [(metric, np.float64) for metric in res])
+        records['replication'] = np.arange(start, start + len(seeds))
+        records['seed'] = seeds
+        for metric, values in res.items():
+            records[metric] = values
+
+        # Write to a temporary file first, so that an interrupted simulation never leaves a partial chunk
+        fname = self.chunk_path(start, start + len(seeds))
+        tmp = fname + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, records)
+        os.replace(tmp, fname)
+
+    def load(self, start, stop):
+        """Results of a completed chunk, as returned by the run_replications functions"""
+        records = np.load(self.chunk_path(start, stop), mmap_mode='r')
+        return {metric: records[metric] for metric in records.dtype.names[2:]}
+
+    def chunks(self):
+        """Memory mapped structured arrays of all the completed chunks, in replication order"""
+        for fname in sorted(glob.glob(os.path.join(self.path, 'chunk_*.npy'))):
+            yield np.load(fname, mmap_mode='r')
+
+    def column(self, metric):
+        """Memory mapped values of the given field, chunk by chunk"""
+        for records in self.chunks():
+            yield records[metric]
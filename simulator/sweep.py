@@ -0,0 +1,178 @@
+import configparser
+import copy
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import config
+import runner
+import simulations
+import stats
+import telemetry
+import utils
+
+# Protocol name -> module running its simulations
+PROTOCOLS = simulations.PROTOCOLS
+
+# Swept parameters, printed out in the statistics tables along with the protocol and the number of stations
+SWEEP_PARAMS = ('max_backoff_time', 'num_epochs', 'packet_prob')
+
+
+def parse_values(value, type_):
+    """Comma separated list of values"""
+    return [type_(v) for v in value.split(',') if v.strip()]
+
+
+def parse_ranges(value, type_):
+    """Semicolon separated list of comma separated intervals, e.g. 0.05,0.2; 0.1,0.3"""
+    return [config.parse_range(v, type_) for v in value.split(';') if v.strip()]
+
+
+def make_job(protocol, num_stations, max_backoff_time, num_epochs, packet_prob):
+    if protocol not in PROTOCOLS:
+        raise ValueError("Protocol %s not supported" % protocol)
+
+    return {
+        'protocol': protocol
+        , 'num_stations': num_stations
+        , 'max_backoff_time': max_backoff_time
+        , 'num_epochs': num_epochs
+        , 'packet_prob': packet_prob
+    }
+
+
+def load_jobs(config_file, cfg):
+    """
+    Jobs of the sweep described by the SWEEP section of the config file, one job per simulation: either the grid
+    of all the combinations of the given parameter values, or the given list of Points.
+    Parameters missing from the SWEEP section, or from a point, take the value of the simulation's config.
+    """
+    parser = configparser.ConfigParser()
+    parser.read(config_file)
+    sweep = parser['SWEEP'] if parser.has_section('SWEEP') else {}
+
+    points = [p for p in sweep.get('Points', '').splitlines() if p.strip()]
+    if points:
+        jobs = []
+        for point in points:
+            # e.g. protocol=aloha NumStations=8 MaxBackoffTime=16 NumEpochs=1000 PacketProb=0.05,0.2
+            p = dict(kv.split('=', 1) for kv in point.split())
+            protocol = p['protocol'].strip().lower()
+            jobs.append(make_job(protocol, int(p['NumStations']),
+                                 int(p.get('MaxBackoffTime', cfg.max_backoff_time)),
+                                 int(p.get('NumEpochs', cfg.num_epochs)),
+                                 config.parse_range(p['PacketProb'], float) if 'PacketProb' in p
+                                 else cfg.packet_prob_ranges[protocol]))
+        return jobs
+
+    protocols = [p.strip().lower() for p in sweep.get('Protocols', 'aloha,csma').split(',')]
+    list_num_stations = parse_values(sweep['NumStations'], int) if 'NumStations' in sweep else cfg.list_num_stations
+    max_backoff_times = parse_values(sweep.get('MaxBackoffTime', str(cfg.max_backoff_time)), int)
+    list_num_epochs = parse_values(sweep.get('NumEpochs', str(cfg.num_epochs)), int)
+
+    jobs = []
+    for protocol in protocols:
+        key = '%sPacketProb' % protocol.capitalize()
+        packet_probs = parse_ranges(sweep[key], float) if key in sweep else [cfg.packet_prob_ranges[protocol]]
+
+        for ns, mbt, ne, pp in itertools.product(list_num_stations, max_backoff_times, list_num_epochs, packet_probs):
+            jobs.append(make_job(protocol, ns, mbt, ne, pp))
+
+    return jobs
+
+
+def job_cost(job, cfg):
+    """Estimated cost of a job, simulation time being linear in the number of stations, epochs and runs"""
+    return job['num_stations'] * job['num_epochs'] * cfg.num_runs
+
+
+def job_config(job, cfg):
+    """Copy of the simulation's config with the parameters of the given job"""
+    cfg_ = copy.copy(cfg)
+    cfg_.max_backoff_time = job['max_backoff_time']
+    cfg_.num_epochs = job['num_epochs']
+    cfg_.packet_prob_ranges = dict(cfg.packet_prob_ranges, **{job['protocol']: job['packet_prob']})
+    # Jobs are the unit of work of the sweep: the runs of a job are all run in the same worker process
+    cfg_.workers = 1
+    # Jobs run by the sweep's worker processes can not each start a coordinator on the same CoordinatorAddress
+    if cfg.workers > 1:
+        cfg_.distributed = False
+
+    return cfg_
+
+
+def completed_runs(res):
+    """Number of runs of a job's results, more than NumRuns in sequential mode"""
+    values = next(iter(runner.columns(res).values()))
+    return values.n if isinstance(values, stats.StreamingSummary) else len(values)
+
+
+def run_job(job, cfg, logger):
+    return PROTOCOLS[job['protocol']].run_simulations(job['num_stations'], job_config(job, cfg), logger)
+
+
+def run_sweep(jobs, cfg, logger):
+    """
+    Run the given jobs over cfg.workers processes and return the list of (job, results) pairs, in the jobs' order.
+    Jobs are scheduled longest first, so that the shortest ones fill the gaps at the end of the sweep rather than
+    a long one being left running alone on a single core.
+    """
+    order = sorted(range(len(jobs)), key=lambda i: job_cost(jobs[i], cfg), reverse=True)
+    results = [None] * len(jobs)
+
+    if cfg.workers > 1:
+        with ProcessPoolExecutor(max_workers=cfg.workers) as pool:
+            # The pool hands out the jobs in the order they are submitted
+            futures = {pool.submit(run_job, jobs[i], cfg, logger): i for i in order}
+            for n, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                results[i] = future.result()
+                logger.info("[SWEEP] :: %d of %d jobs completed" % (n, len(jobs)))
+                # Runs completed by the worker processes, the jobs run in this process are followed by the runner
+                runs = completed_runs(results[i])
+                telemetry.running(jobs[i]['protocol'], jobs[i]['num_stations'])
+                telemetry.advance(runs, runs * jobs[i]['num_epochs'])
+    else:
+        for n, i in enumerate(order, 1):
+            results[i] = run_job(jobs[i], cfg, logger)
+            logger.info("[SWEEP] :: %d of %d jobs completed" % (n, len(jobs)))
+
+    return list(zip(jobs, results))
+
+
+def compute_sweep_stats(sweep_res, cfg, log_):
+    """Stats rows of every job and metric, as by simulations.compute_all_stats, along with the job parameters"""
+    jobs = [job for job, res in sweep_res for _ in runner.columns(res)]
+    pending = [(job['protocol'], job['num_stations'], metric, values)
+               for job, res in sweep_res for metric, values in runner.columns(res).items()]
+
+    rows = simulations.compute_all_stats(pending, cfg, log_)
+    for job, s in zip(jobs, rows):
+        s.update(max_backoff_time=job['max_backoff_time'], num_epochs=job['num_epochs'],
+                 packet_prob=" - ".join(str(x) for x in job['packet_prob']))
+
+    return rows
+
+
+def main():
+    # Retrieve the configuration parameters, the swept ones being overridden by the SWEEP section
+    cfg = config.Config('./config.ini')
+
+    # Create logger
+    log_ = utils.init_logger(is_debug=cfg.is_debug)
+
+    jobs = load_jobs('./config.ini', cfg)
+    log_.info("[SWEEP] :: Running %d jobs over %d workers, estimated cost %d station epochs" %
+              (len(jobs), cfg.workers, sum(job_cost(job, cfg) for job in jobs)))
+
+    telemetry.start(cfg, len(jobs) * cfg.num_runs, sum(job['num_epochs'] for job in jobs) * cfg.num_runs, log_)
+    sweep_res = run_sweep(jobs, cfg, log_)
+    telemetry.close()
+
+    rows = compute_sweep_stats(sweep_res, cfg, log_)
+
+    # Print overall stats in a table-fashioned way, saved to file system only if log level is not DEBUG
+    utils.print_tables(rows, log_, not cfg.is_debug, params_=SWEEP_PARAMS, name='sweep')
+
+
+if __name__ == "__main__":
+    main()
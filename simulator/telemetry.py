@@ -0,0 +1,195 @@
+import http.server
+import os
+import resource
+import sys
+import threading
+import time
+
+# Prefix of the names of the published metrics
+PREFIX = 'simulator_'
+
+
+def resident_memory_bytes():
+    """Current resident set size of this process, its peak where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 2 ** 10)
+
+
+def worker_memory_bytes():
+    """
+    Current resident set size of the largest live child process, e.g. a worker of the runs or of the plots, 0 if
+    there is none. None where /proc is not available: the peak of the terminated child processes, which getrusage
+    reports, does not cover the workers still running.
+    """
+    if not os.path.isdir('/proc/self'):
+        return None
+
+    pid = str(os.getpid())
+    largest = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                # The command name may hold spaces, the parent pid is the second field after its closing parenthesis
+                if f.read().rsplit(')', 1)[1].split()[1] != pid:
+                    continue
+            with open('/proc/%s/statm' % entry) as f:
+                largest = max(largest, int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE'))
+        except (OSError, IndexError, ValueError):
+            # The process went away meanwhile
+            continue
+
+    return largest
+
+
+class Telemetry:
+    """
+    Progress of the current simulation or sweep: completed runs, runs and simulated epochs per second, ETA and memory.
+    Metrics are published in the Prometheus text format to a file, replaced atomically, and optionally served over
+    HTTP on localhost. Publishing is rate-limited to once every interval seconds: advance() only updates two counters
+    and compares two clock readings unless it is time to publish.
+    """
+
+    def __init__(self, path, planned_runs, planned_epochs, interval=1.0, port=0):
+        self.path = path
+        self.planned_runs = planned_runs
+        self.planned_epochs = planned_epochs
+        self.interval = interval
+        self.runs = 0
+        self.epochs = 0
+        self.protocol = ''
+        self.num_stations = 0
+        self.start = time.monotonic()
+        self.last = -float('inf')
+        self.text = ''
+        # Worker processes forked after start() inherit the telemetry, only this process publishes it
+        self.pid = os.getpid()
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.server = None
+        if port:
+            self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+            self.server.telemetry = self
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def running(self, protocol, num_stations):
+        self.protocol = protocol
+        self.num_stations = num_stations
+        self.publish()
+
+    def advance(self, runs, epochs):
+        self.runs += runs
+        self.epochs += epochs
+        if time.monotonic() - self.last >= self.interval:
+            self.publish()
+
+    def render(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        runs_per_second = self.runs / elapsed
+        # Sequential simulations may go on beyond the planned runs
+        remaining = max(self.planned_runs - self.runs, 0)
+        eta = remaining / runs_per_second if runs_per_second else float('nan')
+
+        metrics = [
+            ('runs_completed_total', 'counter', 'Simulation runs completed', self.runs)
+            , ('runs_planned', 'gauge', 'Simulation runs planned', self.planned_runs)
+            , ('epochs_simulated_total', 'counter', 'Epochs simulated by the completed runs', self.epochs)
+            , ('epochs_planned', 'gauge', 'Epochs to be simulated by the planned runs', self.planned_epochs)
+            , ('runs_per_second', 'gauge', 'Completed runs per second', runs_per_second)
+            , ('epochs_per_second', 'gauge', 'Simulated epochs per second', self.epochs / elapsed)
+            , ('eta_seconds', 'gauge', 'Estimated time to complete the planned runs', eta)
+            , ('elapsed_seconds', 'gauge', 'Time elapsed since the start', elapsed)
+            , ('resident_memory_bytes', 'gauge', 'Resident memory of the main process', resident_memory_bytes())
+        ]
+        workers = worker_memory_bytes()
+        if workers is not None:
+            metrics.append(('worker_resident_memory_bytes', 'gauge',
+                            'Resident memory of the largest live worker process', workers))
+
+        lines = []
+        for name, type_, help_, value in metrics:
+            lines += ['# HELP %s%s %s' % (PREFIX, name, help_), '# TYPE %s%s %s' % (PREFIX, name, type_),
+                      '%s%s %s' % (PREFIX, name, repr(float(value)))]
+        lines += ['# HELP %scurrent_simulation Protocol and number of stations being simulated' % PREFIX,
+                  '# TYPE %scurrent_simulation gauge' % PREFIX,
+                  '%scurrent_simulation{protocol="%s",num_stations="%d"} 1' % (PREFIX, self.protocol,
+                                                                               self.num_stations)]
+
+        return '\n'.join(lines) + '\n'
+
+    def publish(self):
+        if os.getpid() != self.pid:
+            return
+        self.last = time.monotonic()
+        self.text = self.render()
+
+        # Write to a temporary file first, so that a scraper never reads a partial file
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.text)
+        os.replace(tmp, self.path)
+
+    def close(self):
+        self.publish()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the last published metrics on any path"""
+
+    def do_GET(self):
+        body = self.server.telemetry.text.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format_, *args):
+        # Scrapes are not logged
+        pass
+
+
+# Telemetry of the current process, None unless started, e.g. by start_simulations when Telemetry is set in config.ini
+_telemetry = None
+
+
+def start(cfg, planned_runs, planned_epochs, logger):
+    """Start publishing the progress of the given number of runs and epochs, if enabled in cfg"""
+    global _telemetry
+    close()
+    if not cfg.telemetry:
+        return
+
+    _telemetry = Telemetry(cfg.telemetry_path, planned_runs, planned_epochs, cfg.telemetry_interval,
+                           cfg.telemetry_port)
+    _telemetry.publish()
+    logger.info("[TELEMETRY] :: Publishing progress to %s%s" % (
+        cfg.telemetry_path, ', http://127.0.0.1:%d/metrics' % cfg.telemetry_port if cfg.telemetry_port else ''))
+
+
+def running(protocol, num_stations):
+    if _telemetry is not None:
+        _telemetry.running(protocol, num_stations)
+
+
+def advance(runs, epochs):
+    if _telemetry is not None:
+        _telemetry.advance(runs, epochs)
+
+
+def close():
+    global _telemetry
+    if _telemetry is not None:
+        _telemetry.close()
+        _telemetry = None
@@ -0,0 +1,139 @@
+import glob
+import json
+import os
+import socket
+import sys
+
+import numpy as np
+
+# Events of a station in an epoch
+TX = 0  # Starts transmitting
+ACK = 1  # Frame delivered
+COLLISION = 2  # Collided, backoff is the backoff time drawn
+DROP = 3  # Collided and exceeded the maximum backoff time, the packet is lost
+DEFER = 4  # CSMA: channel sensed busy, backoff is the time waited before sensing it again
+RESUME = 5  # Backoff time over, ready to re-transmit
+
+EVENT_NAMES = ['TX', 'ACK', 'COLLISION', 'DROP', 'DEFER', 'RESUME']
+
+# Events kept when only collisions are traced
+COLLISION_EVENTS = (COLLISION, DROP, DEFER)
+
+# One record per event: replication (the seed of its RNG stream), epoch, station, event type and backoff time
+TRACE_DTYPE = np.dtype([('replication', np.uint64), ('epoch', np.int32), ('station', np.int32),
+                        ('event', np.uint8), ('backoff', np.int32)])
+
+
+class TraceRecorder:
+    """
+    Records the events of the sampled replications of one (protocol, number of stations) simulation into a
+    preallocated NumPy structured ring buffer. Whenever the buffer is full, and at the end of every chunk of
+    replications, its records are appended to the trace file through a memory map. Each process writes its own
+    file, described by a JSON sidecar file.
+    """
+
+    def __init__(self, path, protocol, num_stations, every=1, events='all', capacity=65536):
+        self.every = every
+        self.kept = set(COLLISION_EVENTS if events == 'collisions' else range(len(EVENT_NAMES)))
+        self.buffer = np.empty(capacity, dtype=TRACE_DTYPE)
+        self.pos = 0
+        self.replication_id = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.fname = os.path.join(path, '%s_%d_%s-%d.trace' % (protocol, num_stations, socket.gethostname(),
+                                                                os.getpid()))
+        open(self.fname, 'ab').close()
+        with open(self.fname + '.json', 'w') as f:
+            json.dump({'protocol': protocol, 'num_stations': num_stations, 'every': every, 'events': events,
+                       'dtype': TRACE_DTYPE.descr, 'event_names': EVENT_NAMES}, f, indent=1)
+
+    def replication(self, index, seed):
+        """
+        The recorder, bound to the replication with the given seed, if it is sampled: every k-th replication, given its
+        index in the simulation, is traced. None otherwise
+        """
+        # Replications are sampled by index, so that the same ones are traced whatever the chunks and the workers
+        if index % self.every:
+            return None
+        self.replication_id = seed
+        return self
+
+    def record(self, epoch, station, event, backoff=0):
+        if event not in self.kept:
+            return
+        self.buffer[self.pos] = (self.replication_id, epoch, station, event, backoff)
+        self.pos += 1
+        if self.pos == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """Append the buffered records to the trace file"""
+        if not self.pos:
+            return
+        offset = os.path.getsize(self.fname)
+        with open(self.fname, 'r+b') as f:
+            f.truncate(offset + self.pos * TRACE_DTYPE.itemsize)
+        chunk = np.memmap(self.fname, dtype=TRACE_DTYPE, mode='r+', offset=offset, shape=(self.pos,))
+        chunk[:] = self.buffer[:self.pos]
+        chunk.flush()
+        del chunk
+        self.pos = 0
+
+
+# Recorders of the current process, one per (protocol, number of stations)
+_recorders = {}
+
+
+def recorder(cfg, protocol, num_stations):
+    """Trace recorder of the given simulation in the current process, None if tracing is disabled"""
+    if not cfg.trace:
+        return None
+    key = (cfg.trace_path, protocol, num_stations)
+    if key not in _recorders:
+        _recorders[key] = TraceRecorder(cfg.trace_path, protocol, num_stations, cfg.trace_every, cfg.trace_events)
+    return _recorders[key]
+
+
+def load(fname):
+    """Records of a trace file, memory mapped: they are only read from disk when accessed"""
+    if not os.path.getsize(fname):
+        return np.empty(0, dtype=TRACE_DTYPE)
+    return np.memmap(fname, dtype=TRACE_DTYPE, mode='r')
+
+
+def trace_files(path, protocol='*', num_stations=None):
+    """Trace files under the given trace directory, of the given protocol and number of stations if any"""
+    ns = '*' if num_stations is None else str(num_stations)
+    return sorted(glob.glob(os.path.join(path, '%s_%s_*.trace' % (protocol, ns))))
+
+
+def traces(path, protocol='*', num_stations=None):
+    """Iterator over the memory mapped records of each trace file"""
+    for fname in trace_files(path, protocol, num_stations):
+        yield load(fname)
+
+
+def replication(path, protocol, num_stations, seed):
+    """Records of the replication with the given seed, in the order they were recorded"""
+    return np.concatenate([t[t['replication'] == seed] for t in traces(path, protocol, num_stations)] or
+                          [np.empty(0, dtype=TRACE_DTYPE)])
+
+
+def collisions(records):
+    """Epochs in which a collision occurred and the number of stations involved in each"""
+    epochs = records['epoch'][np.isin(records['event'], (COLLISION, DROP))]
+    return np.unique(epochs, return_counts=True)
+
+
+def main():
+    # Usage: python simulator/tracing.py <trace directory>
+    # Print the number of replications traced and the number of events of each type, for each trace file
+    for fname in trace_files(sys.argv[1]):
+        t = load(fname)
+        counts = np.bincount(t['event'], minlength=len(EVENT_NAMES))
+        print("%s: %d replications, %s" % (os.path.basename(fname), len(np.unique(t['replication'])),
+                                           ', '.join('%s %d' % (n, c) for n, c in zip(EVENT_NAMES, counts))))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,8 @@
 import logging
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-from tabulate import tabulate
 import time
 
-from station import Station
+# tabulate, matplotlib and pandas are imported by the functions using them, see stats.py
 
 
 def init_logger(logger_type='custom_logger', time_format="%Y-%m-%d %H:%M:%S", is_debug=False):
@@ -24,12 +21,15 @@ def init_logger(logger_type='custom_logger', time_format="%Y-%m-%d %H:%M:%S", is
 
 
 # Print out the overall stats
-def print_tables(data_, log_, save_fig):
+# params_ are the names of further simulation parameters to be printed out after the number of stations, e.g. in a sweep
+def print_tables(data_, log_, save_fig, params_=(), name='stats'):
+    from tabulate import tabulate
 
     res = []
     # Headers to be printed out
-    headers_ = ['protocol', 'num_stations', 'obs', 'mean', 'var', 'std', 'median', 'mad', 'CIs median',
-                'gap', 'gini', 'CoV', 'percentiles']
+    headers_ = ['protocol', 'num_stations'] + list(params_) + ['obs', 'runs', 'mean', 'var', 'std', 'ci', 'median',
+                                                               'mad', 'CIs median', 'CIb median', 'gap', 'CIb gap',
+                                                               'gini', 'CIb gini', 'CoV', 'CIb CoV', 'percentiles']
 
     for d in data_:
         row = []
@@ -42,20 +42,21 @@ def print_tables(data_, log_, save_fig):
     if save_fig:
 
         # Simplest version
-        with open('./data/%s-stats.dat' % (time.strftime("%Y%m%d-%H%M")), 'w') as f:
+        with open('./data/%s-%s.dat' % (time.strftime("%Y%m%d-%H%M"), name), 'w') as f:
             f.write(tabulate(res, headers=headers_, tablefmt="grid"))
 
         # Markdown, github style
-        with open('./data/%s-stats.md' % (time.strftime("%Y%m%d-%H%M")), 'w') as f:
+        with open('./data/%s-%s.md' % (time.strftime("%Y%m%d-%H%M"), name), 'w') as f:
             f.write(tabulate(res, headers=headers_, tablefmt="github"))
 
         # LateX
-        with open('./data/%s-stats.latex' % (time.strftime("%Y%m%d-%H%M")), 'w') as f:
+        with open('./data/%s-%s.latex' % (time.strftime("%Y%m%d-%H%M"), name), 'w') as f:
             f.write(tabulate(res, headers=headers_, tablefmt="latex"))
 
 
 # Deprecated
 def plot_stats(stats, num_stations):
+    import matplotlib.pyplot as plt
     metrics = ['throughput', 'collision_rate', 'delay', 'retransmissions']
     protocols = ['aloha', 'csma']
 
@@ -83,4 +84,5 @@ def plot_stats(stats, num_stations):
 
 # Load stats into a Pandas DataFrame
 def load_df(stats):
+    import pandas as pd
     return pd.DataFrame(stats)